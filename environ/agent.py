@@ -2,15 +2,33 @@
 Class for OpenAI agent
 """
 
+import asyncio
+import hashlib
+import json
 import logging
+import os
 import pickle
+import sqlite3
+import threading
 import time
 from typing import Any
 
-from openai import OpenAI
-from tenacity import retry, stop_after_attempt, wait_random_exponential
-
-from environ.constants import OPEN_AI_API_KEY, PROCESSED_DATA_PATH
+import httpx
+from openai import AsyncOpenAI, OpenAI, RateLimitError
+from openai.types.chat import ChatCompletionTokenLogprob
+from tenacity import RetryCallState, retry, wait_random_exponential
+
+from environ.constants import (
+    OPEN_AI_API_KEY,
+    OPEN_AI_BASE_URL,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_RATE_LIMIT_ATTEMPTS,
+    OPENAI_TIMEOUT,
+    PROCESSED_DATA_PATH,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_PATH,
+)
+from environ.rate_limiter import estimate_tokens, get_rate_limiter
 
 logging.basicConfig(
     level=logging.INFO,
@@ -18,28 +36,336 @@ logging.basicConfig(
     handlers=[logging.StreamHandler()],
 )
 
+# Pooled clients shared by all agents with the same pool settings
+_clients: dict[tuple[int, float], OpenAI] = {}
+
+# Async clients are bound to the event loop they were first used in
+_async_clients: dict[
+    tuple[int, float], tuple[asyncio.AbstractEventLoop, AsyncOpenAI]
+] = {}
+
+
+def _pool_limits(max_connections: int) -> httpx.Limits:
+    """
+    Function to get the keep-alive connection pool limits
+    """
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=60,
+    )
+
+
+def get_client(
+    max_connections: int = OPENAI_MAX_CONNECTIONS, timeout: float = OPENAI_TIMEOUT
+) -> OpenAI:
+    """
+    Function to get the process-wide OpenAI client for a pool configuration
+    """
+    key = (max_connections, timeout)
+
+    if key not in _clients:
+        _clients[key] = OpenAI(
+            api_key=OPEN_AI_API_KEY,
+            base_url=OPEN_AI_BASE_URL,
+            timeout=timeout,
+            http_client=httpx.Client(
+                limits=_pool_limits(max_connections), timeout=timeout
+            ),
+        )
+
+    return _clients[key]
+
+
+def get_async_client(
+    max_connections: int = OPENAI_MAX_CONNECTIONS, timeout: float = OPENAI_TIMEOUT
+) -> AsyncOpenAI:
+    """
+    Function to get the async OpenAI client of the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    key = (max_connections, timeout)
+
+    if key not in _async_clients or _async_clients[key][0] is not loop:
+        _async_clients[key] = (
+            loop,
+            AsyncOpenAI(
+                api_key=OPEN_AI_API_KEY,
+                base_url=OPEN_AI_BASE_URL,
+                timeout=timeout,
+                http_client=httpx.AsyncClient(
+                    limits=_pool_limits(max_connections), timeout=timeout
+                ),
+            ),
+        )
+
+    return _async_clients[key][1]
+
+
+def _stop_retrying(retry_state: RetryCallState) -> bool:
+    """
+    Function to give up after three failures, or more when rate limited
+    """
+    if isinstance(retry_state.outcome.exception(), RateLimitError):
+        return retry_state.attempt_number >= OPENAI_RATE_LIMIT_ATTEMPTS
+    return retry_state.attempt_number >= 3
+
+
+class ResponseCache:
+    """
+    Content-addressed SQLite cache of agent responses with LRU eviction
+    """
+
+    def __init__(
+        self,
+        path: str = str(RESPONSE_CACHE_PATH),
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        read_only: bool = False,
+    ) -> None:
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._conn = None
+
+        if read_only:
+            # Replay only reads, a missing cache is a cache without entries
+            if os.path.exists(self.path):
+                self._conn = sqlite3.connect(
+                    f"file:{self.path}?mode=ro", uri=True, check_same_thread=False
+                )
+            return
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                content TEXT,
+                logprobs TEXT,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_access ON responses (last_access)"
+        )
+        self._conn.commit()
+
+        # Running size of the cached responses, summed once on open
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    @staticmethod
+    def key(**request: Any) -> str:
+        """
+        Static method to hash a request into its cache key
+        """
+        return hashlib.sha256(
+            json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> tuple[str, list | None] | None:
+        """
+        Get the cached text and logprobs of a request
+        """
+        if self._conn is None:
+            return None
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, logprobs FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if not self.read_only:
+                self._conn.execute(
+                    "UPDATE responses SET last_access = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+                self._conn.commit()
+
+        content, logprobs = row
+        if logprobs is None:
+            return content, None
+        return content, [
+            ChatCompletionTokenLogprob.model_validate(logprob)
+            for logprob in json.loads(logprobs)
+        ]
+
+    def set(self, key: str, content: str, logprobs: list | None = None) -> None:
+        """
+        Cache the text and logprobs of a request
+        """
+        if self.read_only:
+            return
+
+        logprobs_json = (
+            None
+            if logprobs is None
+            else json.dumps([logprob.model_dump() for logprob in logprobs])
+        )
+        size = len(content or "") + len(logprobs_json or "")
+
+        with self._lock:
+            replaced = self._conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, content, logprobs_json, size, time.time()),
+            )
+            self._size += size - (replaced[0] if replaced else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """
+        Drop the least recently used responses until the cache fits its size
+        """
+        while self._size > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                self._size = 0
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._size -= size
+                if self._size <= self.max_bytes:
+                    break
+
+
+# Response cache shared by all agents, opened on first use
+_response_cache: ResponseCache | None = None
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Function to get the shared response cache
+    """
+    global _response_cache
+
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+
+    return _response_cache
+
+
+def set_response_cache(cache: ResponseCache) -> None:
+    """
+    Function to replace the shared response cache, e.g. with a read-only one
+    """
+    global _response_cache
+
+    _response_cache = cache
+
+
+class TokenUsage:
+    """
+    Token usage of the completed requests, with the prompt tokens served from
+    the provider's prompt cache
+    """
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, usage: Any) -> None:
+        """
+        Method to add the usage of a response
+        """
+        if usage is None:
+            return
+
+        details = getattr(usage, "prompt_tokens_details", None)
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage.prompt_tokens
+            self.cached_tokens += (details and details.cached_tokens) or 0
+            self.completion_tokens += usage.completion_tokens
+
+    def snapshot(self) -> dict[str, int]:
+        """
+        Method to get the current totals
+        """
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "completion_tokens": self.completion_tokens,
+            }
+
+
+# Token usage of all agents in the process
+_token_usage = TokenUsage()
+
+
+def get_token_usage() -> TokenUsage:
+    """
+    Function to get the shared token usage
+    """
+    return _token_usage
+
 
 class OpenAIAgent:
     """
     Class for OpenAI agent
     """
 
-    def __init__(self, model: str = "gpt-4o-2024-08-06") -> None:
+    def __init__(
+        self,
+        model: str = "gpt-4o-2024-08-06",
+        max_connections: int = OPENAI_MAX_CONNECTIONS,
+        timeout: float = OPENAI_TIMEOUT,
+        use_cache: bool = True,
+    ) -> None:
         self.model = model
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.use_cache = use_cache
 
-    @retry(stop=stop_after_attempt(3), wait=wait_random_exponential(min=1, max=60))
-    def __call__(
-        self,
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        """
+        Restore a pickled agent, filling in the settings of old checkpoints
+        """
+        self.__dict__.update(
+            {
+                "max_connections": OPENAI_MAX_CONNECTIONS,
+                "timeout": OPENAI_TIMEOUT,
+                "use_cache": True,
+                **state,
+            }
+        )
+
+    @property
+    def client(self) -> OpenAI:
+        """
+        The pooled client shared by the agents with the same pool settings
+        """
+        return get_client(self.max_connections, self.timeout)
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """
+        The pooled async client of the running event loop
+        """
+        return get_async_client(self.max_connections, self.timeout)
+
+    @staticmethod
+    def _build_messages(
         prompt: str,
         context: list[dict[str, str]] | None = None,
         instruction: str | None = None,
-        temperature: float = 0,
-        log_probs: bool = False,
-        top_logprobs: int | None = None,
         vision_url: str | None = None,
-    ) -> Any:
+    ) -> list[dict[str, Any]]:
         """
-        Send a message to the agent
+        Static method to assemble the chat messages
         """
 
         # Add vision
@@ -72,24 +398,208 @@ class OpenAIAgent:
                 }
             ] + messages
 
-        response = (
-            OpenAI(api_key=OPEN_AI_API_KEY)
-            .chat.completions.create(
+        return messages
+
+    @staticmethod
+    def _parse_response(response: Any, log_probs: bool = False) -> Any:
+        """
+        Static method to extract the output from the first choice
+        """
+
+        if log_probs:
+            return (
+                response.message.content,
+                response.logprobs.content,
+            )
+        return response.message.content
+
+    def _cache_key(
+        self,
+        messages: list[dict[str, Any]],
+        temperature: float,
+        log_probs: bool,
+        top_logprobs: int | None,
+        vision_url: str | None,
+    ) -> str | None:
+        """
+        Get the response cache key of a request, None if caching is off
+        """
+        if not self.use_cache:
+            return None
+
+        return ResponseCache.key(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            logprobs=log_probs,
+            top_logprobs=top_logprobs,
+            vision_url=vision_url,
+        )
+
+    @staticmethod
+    def _from_cache(key: str | None, log_probs: bool) -> Any:
+        """
+        Static method to get the cached output of a request
+        """
+        cached = get_response_cache().get(key) if key else None
+
+        if cached is None or (log_probs and cached[1] is None):
+            return None
+        return cached if log_probs else cached[0]
+
+    @staticmethod
+    def _to_cache(key: str | None, response: Any, log_probs: bool) -> None:
+        """
+        Static method to cache the output of a request
+        """
+        if key:
+            get_response_cache().set(
+                key,
+                response.message.content,
+                response.logprobs.content if log_probs else None,
+            )
+
+    def _create(
+        self,
+        messages: list[dict[str, Any]],
+        temperature: float,
+        log_probs: bool,
+        top_logprobs: int | None,
+        usage: TokenUsage | None = None,
+    ) -> Any:
+        """
+        Request a chat completion within the shared rate limits, adding its
+        token usage to the process totals and to usage if given
+        """
+        limiter = get_rate_limiter()
+        tokens = estimate_tokens(messages)
+        limiter.acquire(tokens)
+
+        try:
+            raw = self.client.chat.completions.with_raw_response.create(
                 model=self.model,
                 messages=messages,
                 temperature=temperature,
                 logprobs=log_probs,
                 top_logprobs=top_logprobs,
             )
-            .choices[0]
+        except RateLimitError as e:
+            limiter.backoff(e.response.headers)
+            raise
+
+        completion = raw.parse()
+        limiter.update(
+            raw.headers,
+            tokens,
+            completion.usage.total_tokens if completion.usage else tokens,
         )
+        get_token_usage().record(completion.usage)
+        if usage is not None:
+            usage.record(completion.usage)
 
-        if log_probs:
-            return (
-                response.message.content,
-                response.logprobs.content,
+        return completion.choices[0]
+
+    async def _acreate(
+        self,
+        messages: list[dict[str, Any]],
+        temperature: float,
+        log_probs: bool,
+        top_logprobs: int | None,
+        usage: TokenUsage | None = None,
+    ) -> Any:
+        """
+        Request a chat completion within the shared rate limits asynchronously,
+        adding its token usage to the process totals and to usage if given
+        """
+        limiter = get_rate_limiter()
+        tokens = estimate_tokens(messages)
+        await limiter.aacquire(tokens)
+
+        try:
+            raw = await self.async_client.chat.completions.with_raw_response.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                logprobs=log_probs,
+                top_logprobs=top_logprobs,
             )
-        return response.message.content
+        except RateLimitError as e:
+            limiter.backoff(e.response.headers)
+            raise
+
+        completion = raw.parse()
+        limiter.update(
+            raw.headers,
+            tokens,
+            completion.usage.total_tokens if completion.usage else tokens,
+        )
+        get_token_usage().record(completion.usage)
+        if usage is not None:
+            usage.record(completion.usage)
+
+        return completion.choices[0]
+
+    @retry(stop=_stop_retrying, wait=wait_random_exponential(min=1, max=60))
+    def __call__(
+        self,
+        prompt: str,
+        context: list[dict[str, str]] | None = None,
+        instruction: str | None = None,
+        temperature: float = 0,
+        log_probs: bool = False,
+        top_logprobs: int | None = None,
+        vision_url: str | None = None,
+        usage: TokenUsage | None = None,
+    ) -> Any:
+        """
+        Send a message to the agent, counting the tokens of an uncached
+        response in usage if given
+        """
+
+        messages = self._build_messages(prompt, context, instruction, vision_url)
+        key = self._cache_key(
+            messages, temperature, log_probs, top_logprobs, vision_url
+        )
+        cached = self._from_cache(key, log_probs)
+        if cached is not None:
+            return cached
+
+        response = self._create(messages, temperature, log_probs, top_logprobs, usage)
+        self._to_cache(key, response, log_probs)
+
+        return self._parse_response(response, log_probs)
+
+    @retry(stop=_stop_retrying, wait=wait_random_exponential(min=1, max=60))
+    async def acall(
+        self,
+        prompt: str,
+        context: list[dict[str, str]] | None = None,
+        instruction: str | None = None,
+        temperature: float = 0,
+        log_probs: bool = False,
+        top_logprobs: int | None = None,
+        vision_url: str | None = None,
+        usage: TokenUsage | None = None,
+    ) -> Any:
+        """
+        Send a message to the agent without blocking the event loop, counting
+        the tokens of an uncached response in usage if given
+        """
+
+        messages = self._build_messages(prompt, context, instruction, vision_url)
+        key = self._cache_key(
+            messages, temperature, log_probs, top_logprobs, vision_url
+        )
+        cached = self._from_cache(key, log_probs)
+        if cached is not None:
+            return cached
+
+        response = await self._acreate(
+            messages, temperature, log_probs, top_logprobs, usage
+        )
+        self._to_cache(key, response, log_probs)
+
+        return self._parse_response(response, log_probs)
 
 
 class FTAgent(OpenAIAgent):
@@ -97,8 +607,19 @@ class FTAgent(OpenAIAgent):
     Class for fine-tuned agent
     """
 
-    def __init__(self, model: str = "gpt-4o-2024-08-06") -> None:
-        super().__init__(model=model)
+    def __init__(
+        self,
+        model: str = "gpt-4o-2024-08-06",
+        max_connections: int = OPENAI_MAX_CONNECTIONS,
+        timeout: float = OPENAI_TIMEOUT,
+        use_cache: bool = True,
+    ) -> None:
+        super().__init__(
+            model=model,
+            max_connections=max_connections,
+            timeout=timeout,
+            use_cache=use_cache,
+        )
 
     def _get_output_model_id(self, job_id: str) -> Any:
         """
@@ -106,9 +627,7 @@ class FTAgent(OpenAIAgent):
         """
 
         while True:
-            fine_tune_status = OpenAI(
-                api_key=OPEN_AI_API_KEY
-            ).fine_tuning.jobs.retrieve(job_id)
+            fine_tune_status = self.client.fine_tuning.jobs.retrieve(job_id)
 
             status = fine_tune_status.status
 
@@ -150,14 +669,34 @@ class FTAgent(OpenAIAgent):
             vision_url=vision_url,
         )
 
-    def predict_from_prompt(
+    async def apredict(
         self,
-        prompt: dict[str, list[dict[str, str]]],
+        assistant_msg: str,
+        context: list[dict[str, str]] | None = None,
+        instruction: str | None = None,
         log_probs: bool = False,
         top_logprobs: int | None = None,
+        vision_url: str | None = None,
     ) -> Any:
         """
-        Predict the response from the prompt
+        Predict the response asynchronously
+        """
+        return await self.acall(
+            assistant_msg,
+            context=context,
+            instruction=instruction,
+            temperature=0,
+            log_probs=log_probs,
+            top_logprobs=top_logprobs,
+            vision_url=vision_url,
+        )
+
+    @staticmethod
+    def _split_prompt(
+        prompt: dict[str, list[dict[str, Any]]], vision: bool = False
+    ) -> dict[str, Any]:
+        """
+        Static method to split a prompt into the prediction arguments
         """
 
         msg = prompt["messages"]
@@ -170,10 +709,32 @@ class FTAgent(OpenAIAgent):
         else:
             context = None
 
+        if vision:
+            return {
+                "assistant_msg": msg[1]["content"][0]["text"],
+                "context": context,
+                "instruction": msg[0]["content"],
+                "vision_url": msg[1]["content"][1]["image_url"]["url"],
+            }
+
+        return {
+            "assistant_msg": msg[1]["content"],
+            "context": context,
+            "instruction": msg[0]["content"],
+        }
+
+    def predict_from_prompt(
+        self,
+        prompt: dict[str, list[dict[str, str]]],
+        log_probs: bool = False,
+        top_logprobs: int | None = None,
+    ) -> Any:
+        """
+        Predict the response from the prompt
+        """
+
         return self.predict(
-            assistant_msg=msg[1]["content"],
-            context=context,
-            instruction=msg[0]["content"],
+            **self._split_prompt(prompt),
             log_probs=log_probs,
             top_logprobs=top_logprobs,
         )
@@ -188,45 +749,201 @@ class FTAgent(OpenAIAgent):
         Predict the response from the image
         """
 
-        msg = prompt["messages"]
+        return self.predict(
+            **self._split_prompt(prompt, vision=True),
+            log_probs=log_probs,
+            top_logprobs=top_logprobs,
+        )
 
-        # If the message has more than 2 parts
-        # Then the parts before the last two are the context
-        if len(msg) > 3:
-            context = msg[:2]
-            msg = msg[2:]
-        else:
-            context = None
+    async def apredict_from_prompt(
+        self,
+        prompt: dict[str, list[dict[str, str]]],
+        log_probs: bool = False,
+        top_logprobs: int | None = None,
+    ) -> Any:
+        """
+        Predict the response from the prompt asynchronously
+        """
 
-        return self.predict(
-            assistant_msg=msg[1]["content"][0]["text"],
-            context=context,
-            instruction=msg[0]["content"],
+        return await self.apredict(
+            **self._split_prompt(prompt),
+            log_probs=log_probs,
+            top_logprobs=top_logprobs,
+        )
+
+    async def apredict_from_image(
+        self,
+        prompt: dict,
+        log_probs: bool = False,
+        top_logprobs: int | None = None,
+    ) -> Any:
+        """
+        Predict the response from the image asynchronously
+        """
+
+        return await self.apredict(
+            **self._split_prompt(prompt, vision=True),
             log_probs=log_probs,
             top_logprobs=top_logprobs,
-            vision_url=msg[1]["content"][1]["image_url"]["url"],
         )
 
     def fine_tuning(self, dataset_path: str) -> None:
         """
         Fine-tune the GPT-3.5 model on the news dataset.
         """
-        file_id = (
-            OpenAI(api_key=OPEN_AI_API_KEY)
-            .files.create(
-                file=open(dataset_path, "rb"),
-                purpose="fine-tune",
-            )
-            .id
-        )
+        with open(dataset_path, "rb") as file:
+            file_id = self.client.files.create(file=file, purpose="fine-tune").id
 
-        ft = OpenAI(api_key=OPEN_AI_API_KEY).fine_tuning.jobs.create(
+        ft = self.client.fine_tuning.jobs.create(
             training_file=file_id, model=self.model
         )
         logging.info("Fine-tuning job created with ID %s", ft.id)
 
         self.model = self._get_output_model_id(ft.id)
 
+    def batch_request(
+        self,
+        custom_id: str,
+        prompt: dict,
+        vision: bool = False,
+        log_probs: bool = False,
+        top_logprobs: int | None = None,
+    ) -> dict[str, Any]:
+        """
+        Serialise a prompt into a line of a Batch API input file
+        """
+        kwargs = self._split_prompt(prompt, vision=vision)
+
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model,
+                "messages": self._build_messages(
+                    kwargs["assistant_msg"],
+                    context=kwargs["context"],
+                    instruction=kwargs["instruction"],
+                    vision_url=kwargs.get("vision_url"),
+                ),
+                "temperature": 0,
+                "logprobs": log_probs,
+                "top_logprobs": top_logprobs,
+            },
+        }
+
+    @staticmethod
+    def batch_id_path(batch_path: str) -> str:
+        """
+        Static method to get the file the ID of a submitted batch is kept in
+        """
+        return os.path.splitext(str(batch_path))[0] + ".batch_id"
+
+    def submit_batch(self, batch_path: str) -> str:
+        """
+        Submit a Batch API input file and return the batch ID, or the ID of
+        the batch already submitted from it by an interrupted run
+        """
+        id_path = self.batch_id_path(batch_path)
+        if os.path.exists(id_path):
+            with open(id_path, "r", encoding="utf-8") as f:
+                batch_id = f.read().strip()
+            logging.info("Resuming batch %s", batch_id)
+            return batch_id
+
+        with open(batch_path, "rb") as file:
+            file_id = self.client.files.create(file=file, purpose="batch").id
+
+        batch = self.client.batches.create(
+            input_file_id=file_id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        logging.info("Batch created with ID %s", batch.id)
+
+        tmp_path = f"{id_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(batch.id)
+        os.replace(tmp_path, id_path)
+
+        return batch.id
+
+    def clear_batch(self, batch_path: str) -> None:
+        """
+        Forget the batch submitted from an input file once its results are in
+        """
+        if os.path.exists(self.batch_id_path(batch_path)):
+            os.remove(self.batch_id_path(batch_path))
+
+    def _wait_batch(self, batch_id: str, poll_interval: int = 60) -> Any:
+        """
+        Wait for a batch to complete, fail, expire or be cancelled
+        """
+
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+
+            if batch.status == "completed":
+                logging.info("Batch completed")
+                return batch
+            elif batch.status in ["failed", "expired", "cancelled"]:
+                logging.error("Batch %s", batch.status)
+                return batch
+
+            time.sleep(poll_interval)
+
+    def _batch_lines(self, file_id: str | None) -> list[dict[str, Any]]:
+        """
+        Get the result lines of a batch output or error file
+        """
+        if file_id is None:
+            return []
+
+        return [
+            json.loads(line)
+            for line in self.client.files.content(file_id).text.splitlines()
+            if line.strip()
+        ]
+
+    def batch_results(
+        self, batch_id: str, poll_interval: int = 60
+    ) -> dict[str, tuple[str, list[ChatCompletionTokenLogprob] | None]]:
+        """
+        Wait for a batch and get the output and logprobs of each request that
+        succeeded, logging the ones that failed
+        """
+        batch = self._wait_batch(batch_id, poll_interval)
+
+        # an expired or cancelled batch can still have partial results
+        results = {}
+        for result in self._batch_lines(batch.output_file_id) + self._batch_lines(
+            batch.error_file_id
+        ):
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                logging.error(
+                    "Batch request %s failed: %s",
+                    result["custom_id"],
+                    result.get("error") or response.get("body"),
+                )
+                continue
+
+            choice = response["body"]["choices"][0]
+            logprobs = (choice.get("logprobs") or {}).get("content")
+            results[result["custom_id"]] = (
+                choice["message"]["content"],
+                (
+                    None
+                    if logprobs is None
+                    else [
+                        ChatCompletionTokenLogprob.model_validate(logprob)
+                        for logprob in logprobs
+                    ]
+                ),
+            )
+
+        return results
+
 
 if __name__ == "__main__":
     agent = OpenAIAgent(model="gpt-4o-2024-08-06")
@@ -0,0 +1,233 @@
+"""
+Local stand-in for the OpenAI Files and Batch endpoints, for tests
+"""
+
+import json
+import re
+import time
+from email.parser import BytesParser
+from email.policy import default
+from typing import Any, Callable
+
+import httpx
+from openai import OpenAI
+
+# Base URL the stand-in client sends its requests to
+STAND_IN_BASE_URL = "http://batch-stand-in/v1"
+
+# Statuses a batch moves through, one per poll
+BATCH_STATUSES = ["validating", "in_progress", "finalizing", "completed"]
+
+
+def completion_body(
+    content: str, tokens: list[str] | None = None, logprob: float = -0.1
+) -> dict[str, Any]:
+    """
+    Function to build a chat completion response body, with each token as
+    its own only top logprob
+    """
+    tokens = tokens if tokens is not None else re.findall(r"\s*\S+", content)
+    logprobs = [
+        {
+            "token": token,
+            "logprob": logprob,
+            "bytes": list(token.encode("utf-8")),
+            "top_logprobs": [
+                {"token": token, "logprob": logprob, "bytes": None},
+            ],
+        }
+        for token in tokens
+    ]
+
+    return {
+        "id": "chatcmpl-stand-in",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "stand-in",
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "logprobs": {"content": logprobs},
+                "finish_reason": "stop",
+            }
+        ],
+    }
+
+
+class BatchServer:
+    """
+    In-memory stand-in for the Files and Batch endpoints, answering each
+    batch request with a responder and completing a batch over a few polls
+    """
+
+    def __init__(
+        self,
+        respond: Callable[[dict[str, Any]], dict[str, Any]] = lambda body: (
+            completion_body("Stand-in response")
+        ),
+    ) -> None:
+        self.respond = respond
+        self.files: dict[str, tuple[str, bytes]] = {}
+        self.batches: dict[str, dict[str, Any]] = {}
+        self.polls: dict[str, int] = {}
+
+    def client(self) -> OpenAI:
+        """
+        Method to get an OpenAI client whose requests are served in memory
+        """
+        return OpenAI(
+            api_key="stand-in",
+            base_url=STAND_IN_BASE_URL,
+            http_client=httpx.Client(transport=httpx.MockTransport(self.handle)),
+            max_retries=0,
+        )
+
+    def _add_file(self, purpose: str, content: bytes) -> str:
+        """
+        Method to store a file and return its ID
+        """
+        file_id = f"file-{len(self.files)}"
+        self.files[file_id] = (purpose, content)
+
+        return file_id
+
+    def _file(self, file_id: str) -> dict[str, Any]:
+        """
+        Method to describe a stored file
+        """
+        purpose, content = self.files[file_id]
+
+        return {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": f"{file_id}.jsonl",
+            "purpose": purpose,
+            "status": "processed",
+        }
+
+    def _upload(self, request: httpx.Request) -> dict[str, Any]:
+        """
+        Method to store a file uploaded as multipart form data
+        """
+        form = BytesParser(policy=default).parsebytes(
+            b"Content-Type: "
+            + request.headers["content-type"].encode("utf-8")
+            + b"\r\n\r\n"
+            + request.content
+        )
+        fields = {
+            part.get_param("name", header="content-disposition"): part.get_payload(
+                decode=True
+            )
+            for part in form.iter_parts()
+        }
+
+        return self._file(
+            self._add_file(fields["purpose"].decode("utf-8"), fields["file"])
+        )
+
+    def _create_batch(self, request: httpx.Request) -> dict[str, Any]:
+        """
+        Method to create a batch from an uploaded input file
+        """
+        body = json.loads(request.content)
+        batch_id = f"batch-{len(self.batches)}"
+        self.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"],
+            "completion_window": body["completion_window"],
+            "status": BATCH_STATUSES[0],
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+        }
+        self.polls[batch_id] = 0
+
+        return self.batches[batch_id]
+
+    def _run_batch(self, batch: dict[str, Any]) -> None:
+        """
+        Method to answer the requests of a batch, sorting the answers into an
+        output and an error file
+        """
+        outputs, errors = [], []
+        for i, line in enumerate(self.files[batch["input_file_id"]][1].splitlines()):
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            try:
+                result = {
+                    "id": f"response-{i}",
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "request_id": f"request-{i}",
+                        "body": self.respond(request["body"]),
+                    },
+                    "error": None,
+                }
+                outputs.append(result)
+            except Exception as e:  # pylint: disable=broad-except
+                errors.append(
+                    {
+                        "id": f"response-{i}",
+                        "custom_id": request["custom_id"],
+                        "response": {
+                            "status_code": 500,
+                            "request_id": f"request-{i}",
+                            "body": {"error": {"message": str(e)}},
+                        },
+                        "error": None,
+                    }
+                )
+
+        for key, results in [("output_file_id", outputs), ("error_file_id", errors)]:
+            if results:
+                batch[key] = self._add_file(
+                    "batch_output",
+                    "".join(json.dumps(result) + "\n" for result in results).encode(
+                        "utf-8"
+                    ),
+                )
+
+    def _retrieve_batch(self, batch_id: str) -> dict[str, Any]:
+        """
+        Method to poll a batch, moving it one status forward
+        """
+        batch = self.batches[batch_id]
+        if batch["status"] in BATCH_STATUSES[:-1]:
+            self.polls[batch_id] += 1
+            batch["status"] = BATCH_STATUSES[
+                min(self.polls[batch_id], len(BATCH_STATUSES) - 1)
+            ]
+            if batch["status"] == "completed":
+                self._run_batch(batch)
+
+        return batch
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        """
+        Method to serve a request to the stand-in endpoints
+        """
+        path = request.url.path.removeprefix("/v1")
+
+        if request.method == "POST" and path == "/files":
+            return httpx.Response(200, json=self._upload(request))
+        if request.method == "POST" and path == "/batches":
+            return httpx.Response(200, json=self._create_batch(request))
+
+        match = re.fullmatch(r"/files/([^/]+)/content", path)
+        if request.method == "GET" and match and match[1] in self.files:
+            return httpx.Response(200, content=self.files[match[1]][1])
+        match = re.fullmatch(r"/batches/([^/]+)", path)
+        if request.method == "GET" and match and match[1] in self.batches:
+            return httpx.Response(200, json=self._retrieve_batch(match[1]))
+
+        return httpx.Response(
+            404, json={"error": {"message": f"No stand-in for {request.url.path}"}}
+        )
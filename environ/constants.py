@@ -15,6 +15,12 @@ for directory in [DATA_PATH, PROCESSED_DATA_PATH, FIGURE_PATH, TABLE_PATH]:
     os.makedirs(directory, exist_ok=True)
 
 
+# Labels of the predicted trend, the first one is the label scored by the agent
+LABEL = ["Rise", "Fall"]
+
+# Quintile labels of the asset pricing portfolios, from the lowest probability
+AP_LABEL = ["Very Low", "Low", "Medium", "High", "Very High"]
+
 # TOP 30 cryptos each week
 CROSS_SECTIONAL_CRYPTO_NUMBER = 30
 
@@ -26,8 +32,39 @@ FAMA_FRENCH_DAILY_FACTOR = (
 
 # API Keys
 OPEN_AI_API_KEY = os.getenv("OPEN_AI_API_KEY")
+# Optional OpenAI-compatible endpoint, e.g. a local stand-in server for tests
+OPEN_AI_BASE_URL = os.getenv("OPEN_AI_BASE_URL") or None
 CC_API_KEY = os.getenv("CC_API_KEY")
 
+# OpenAI connection pool: maximum open connections and request timeout (seconds)
+OPENAI_MAX_CONNECTIONS = 100
+OPENAI_TIMEOUT = 120.0
+
+# OpenAI rate limits before the x-ratelimit-* headers are seen, the token
+# estimates per request, and the retries of a rate-limited request
+OPENAI_RPM = 500
+OPENAI_TPM = 30_000
+OPENAI_COMPLETION_TOKENS = 256
+OPENAI_IMAGE_TOKENS = 1_105
+OPENAI_RATE_LIMIT_ATTEMPTS = 10
+
+# Annotation requests in flight while generating a fine-tuning set
+ANNOTATION_CONCURRENCY = 8
+
+# On-disk cache of agent responses and its size bound (bytes)
+RESPONSE_CACHE_PATH = PROCESSED_DATA_PATH / "cache" / "responses.sqlite"
+RESPONSE_CACHE_MAX_BYTES = 2 * 1024**3
+
+# On-disk cache of the materialised test-set prompts
+PROMPT_CACHE_PATH = PROCESSED_DATA_PATH / "cache" / "prompts"
+
+# Steps logged to a JSONL record between two fsyncs
+RECORD_FSYNC_EVERY = 32
+
+# Temporary buckets a JSONL shuffle spreads its records over, bounding the
+# records held in memory to one bucket
+JSONL_SHUFFLE_BUCKETS = 64
+
 # Columns to exclude from factor strategy lists
 EXCLUDE_LIST = [
     "size_age",
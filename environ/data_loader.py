@@ -2,8 +2,9 @@
 Data Loader
 """
 
-import json
-from typing import Dict, Generator, List
+import os
+from functools import cache
+from typing import Any, Dict, Generator, List, Tuple
 
 import pandas as pd
 
@@ -15,9 +16,34 @@ from environ.constants import (
     MKT_FACTOR_DESCRIPTION_MAPPING,
     PROCESSED_DATA_PATH,
 )
-from scripts.process.signal.market_factors import market_factors
-from scripts.sp import sp_df
-from scripts.nasdaq import nasdaq_df
+from environ.jsonl import batched, read_jsonl
+from environ.storage import filter_dataset, read_dataset, stored_path
+
+# Datasets parsed in this process, with the mtime of the file they came from
+_datasets: Dict[str, Tuple[int, pd.DataFrame]] = {}
+
+# Literature texts read in this process
+_literature: Dict[str, str] = {}
+
+
+@cache
+def get_market_factors() -> pd.DataFrame:
+    """
+    Function to get the market factors, processed on first use
+    """
+    from scripts.process.signal.market_factors import market_factors
+
+    return market_factors
+
+
+@cache
+def get_nasdaq_data() -> pd.DataFrame:
+    """
+    Function to get the NASDAQ returns, processed on first use
+    """
+    from scripts.nasdaq import nasdaq_df
+
+    return nasdaq_df
 
 
 class DataLoader:
@@ -50,26 +76,66 @@ class DataLoader:
             [f"{factor_mapping[factor]}: {data[factor]}\n" for factor in strategy_list]
         )
 
+    @staticmethod
+    def _strategy_description_column(
+        strategy_list: List[str], data: pd.DataFrame, factor_mapping: Dict
+    ) -> pd.Series:
+        """
+        Static method to get the strategy descriptions of every row at once,
+        matching _strategy_descriptions row by row
+        """
+        descriptions = pd.Series("", index=data.index, dtype=object)
+        for factor in strategy_list:
+            descriptions += (
+                f"{factor_mapping[factor]}: "
+                + data[factor].astype(object).map("{}".format)
+                + "\n"
+            )
+
+        return descriptions
+
+    @staticmethod
+    def read(
+        name: str,
+        columns: List[str] | None = None,
+        filters: List[Tuple[str, str, Any]] | None = None,
+    ) -> pd.DataFrame:
+        """
+        Static method to read a dataset through the process-wide cache, which
+        parses each file once and re-reads it only when it changes on disk
+        """
+        mtime = os.stat(stored_path(name)).st_mtime_ns
+        if name not in _datasets or _datasets[name][0] != mtime:
+            _datasets[name] = (mtime, read_dataset(name))
+
+        df = _datasets[name][1]
+        if filters:
+            df = filter_dataset(df, filters).reset_index(drop=True)
+        if columns:
+            df = df[columns]
+
+        # a shallow copy shares the cached data without exposing the cached frame
+        return df.copy(deep=False)
+
     def get_literature_data(self, name: str) -> str:
         """
-        Get literature data
+        Get literature data, read once per process
         """
 
-        with open(
-            f"{PROCESSED_DATA_PATH}/literature/{name}.txt", "r", encoding="utf-8"
-        ) as f:
-            literature = f.read()
+        if name not in _literature:
+            with open(
+                f"{PROCESSED_DATA_PATH}/literature/{name}.txt", "r", encoding="utf-8"
+            ) as f:
+                _literature[name] = f.read()
 
-        return literature
+        return _literature[name]
 
     def get_factor_data(self) -> pd.DataFrame:
         """
         Get factor data
         """
 
-        df = pd.read_csv(f"{PROCESSED_DATA_PATH}/signal/gecko_signal.csv").sort_values(
-            ["id", "time"], ascending=True
-        )
+        df = self.read("gecko_signal").sort_values(["id", "time"], ascending=True)
 
         for var in ["year", "week"]:
             df[var] = df[var].apply(str)
@@ -81,8 +147,7 @@ class DataLoader:
         Method to get environment data
         """
 
-        env_data = pd.read_csv(f"{PROCESSED_DATA_PATH}/env/gecko_daily_env.csv")
-        env_data["time"] = pd.to_datetime(env_data["time"])
+        env_data = self.read("gecko_daily_env")
 
         # The test data is the next week data
         env_data["time"] = env_data["time"] - pd.Timedelta(days=7)
@@ -107,15 +172,27 @@ class DataLoader:
 
         cross_sectional_data = {}
 
-        dff = pd.read_csv(f"{PROCESSED_DATA_PATH}/signal/gecko_signal.csv").sort_values(
-            ["id", "time"], ascending=True
-        )
+        dff = self.read("gecko_signal").sort_values(["id", "time"], ascending=True)
         dff = dff.loc[dff["time"].between(start_date, end_date)]
 
+        # Build the descriptions of all weeks for each strategy in one pass
+        descriptions = {
+            strategy: self._strategy_description_column(
+                self._strategy_list(strategy, dff), dff, CS_FACTOR_DESCRIPTION_MAPPING
+            )
+            for strategy in ["size", "mom", "volume", "vol"]
+        }
+
         for (year, week), weekly_data in dff.groupby(["year", "week"]):
             year_week_key = f"{year}{week}"
             cross_sectional_data[year_week_key] = {
-                strategy: {} for strategy in ["size", "mom", "volume", "vol", "trend"]
+                strategy: dict(
+                    zip(
+                        weekly_data["name"],
+                        descriptions[strategy].loc[weekly_data.index],
+                    )
+                )
+                for strategy in ["size", "mom", "volume", "vol"]
             }
 
             # Add trend
@@ -123,16 +200,6 @@ class DataLoader:
                 "name"
             )["ret_signal"].to_dict()
 
-            # Process strategies
-            for strategy in ["size", "mom", "volume", "vol"]:
-                strategy_list = self._strategy_list(strategy, weekly_data)
-                for _, row in weekly_data.iterrows():
-                    cross_sectional_data[year_week_key][strategy][row["name"]] = (
-                        self._strategy_descriptions(
-                            strategy_list, row, CS_FACTOR_DESCRIPTION_MAPPING
-                        )
-                    )
-
         return cross_sectional_data
 
     def get_mkt_data(
@@ -145,36 +212,52 @@ class DataLoader:
         """
 
         market_data = {}
+        market_factors = get_market_factors()
 
-        market_factors.sort_values(["year", "week"], ascending=True, inplace=True)
-
-        dfm = pd.read_csv(PROCESSED_DATA_PATH / "market" / "cmkt.csv")
+        dfm = self.read("cmkt")
         dfm = dfm.loc[dfm["time"].between(start_date, end_date)]
 
-        for _, row in dfm.iterrows():
-            year_week_key = str(row["year"]) + str(row["week"])
-            market_factor_yw = (
-                market_factors.loc[
-                    (market_factors["year"] == row["year"])
-                    & (market_factors["week"] == row["week"])
-                ]
-                .iloc[0]
-                .copy()
+        # Join the first market factor row of each week
+        dfm = dfm.merge(
+            market_factors.sort_values(["year", "week"], ascending=True)
+            .drop_duplicates(["year", "week"])
+            .drop(
+                columns=[col for col in dfm.columns if col not in ["year", "week"]],
+                errors="ignore",
+            ),
+            on=["year", "week"],
+            how="left",
+            indicator=True,
+        )
+        missing = dfm.loc[dfm["_merge"] == "left_only", ["year", "week"]]
+        if not missing.empty:
+            raise ValueError(
+                f"No market factors for year-weeks {missing.values.tolist()}"
             )
 
+        descriptions = {
+            strategy: self._strategy_description_column(
+                self._strategy_list(strategy, market_factors),
+                dfm,
+                MKT_FACTOR_DESCRIPTION_MAPPING,
+            )
+            for strategy in ["attn", "net", "news"]
+        }
+
+        for year_week_key, trend, attn, net, news in zip(
+            dfm["year"].astype(str) + dfm["week"].astype(str),
+            dfm["trend"],
+            descriptions["attn"],
+            descriptions["net"],
+            descriptions["news"],
+        ):
             market_data[year_week_key] = {
-                "trend": row["trend"],
-                "attn": None,
-                "net": None,
-                "news": None,
+                "trend": trend,
+                "attn": attn,
+                "net": net,
+                "news": news,
             }
 
-            for strategy in ["attn", "net", "news"]:
-                strategy_list = self._strategy_list(strategy, market_factors)
-                market_data[year_week_key][strategy] = self._strategy_descriptions(
-                    strategy_list, market_factor_yw, MKT_FACTOR_DESCRIPTION_MAPPING
-                )
-
         return market_data
 
     def get_vision_data(
@@ -186,9 +269,7 @@ class DataLoader:
 
         vision_data = {}
 
-        dff = pd.read_csv(f"{PROCESSED_DATA_PATH}/signal/gecko_signal.csv").sort_values(
-            ["id", "time"], ascending=True
-        )
+        dff = self.read("gecko_signal").sort_values(["id", "time"], ascending=True)
         dff = dff.loc[dff["time"].between(start_date, end_date)]
 
         for (year, week), weekly_data in dff.groupby(["year", "week"]):
@@ -213,27 +294,23 @@ class DataLoader:
         return vision_data
 
     def get_cs_prompt(
-        self, path: str = f"{PROCESSED_DATA_PATH}/train/cs.jsonl"
+        self,
+        path: str = f"{PROCESSED_DATA_PATH}/train/cs.jsonl",
+        batch_size: int = CROSS_SECTIONAL_CRYPTO_NUMBER,
     ) -> Generator:
         """
-        Get the cs prompt
+        Get the cs prompts in batches, streamed from a plain or zstd JSONL file
         """
 
-        with open(path, "r", encoding="utf-8") as f:
-            prompt_list = []
-            for i, line in enumerate(f, 1):
-                prompt_list.append(json.loads(line))
-                if i % CROSS_SECTIONAL_CRYPTO_NUMBER == 0:
-                    yield prompt_list
-                    prompt_list = []
+        yield from batched(read_jsonl(path), batch_size)
 
     def get_n_data(self) -> pd.DataFrame:
         """
         Get 1/N data
         """
 
-        signal = pd.read_csv(
-            f"{PROCESSED_DATA_PATH}/signal/gecko_signal.csv"
+        signal = self.read(
+            "gecko_signal", columns=["id", "time", "year", "week"]
         ).sort_values(["id", "time"], ascending=True)
         for var in ["year", "week"]:
             signal[var] = signal[var].apply(str)
@@ -263,7 +340,7 @@ class DataLoader:
         Get the market data
         """
 
-        cmkt = nasdaq_df.copy()
+        cmkt = get_nasdaq_data().copy()
         cmkt["time"] = pd.to_datetime(cmkt["time"])
         cmkt["time"] = cmkt["time"] - pd.Timedelta(days=7)
 
@@ -274,9 +351,11 @@ class DataLoader:
         Get the Bitcoin data
         """
 
-        btc = pd.read_csv(f"{PROCESSED_DATA_PATH}/env/gecko_daily_env.csv")
-        btc = btc.loc[btc["id"] == "bitcoin", ["time", "daily_ret"]]
-        btc["time"] = pd.to_datetime(btc["time"])
+        btc = self.read(
+            "gecko_daily_env",
+            columns=["time", "daily_ret"],
+            filters=[("id", "==", "bitcoin")],
+        )
         btc["time"] = btc["time"] - pd.Timedelta(days=7)
         btc.rename(columns={"daily_ret": "BTC"}, inplace=True)
 
@@ -287,9 +366,11 @@ class DataLoader:
         Get the Ethereum data
         """
 
-        eth = pd.read_csv(f"{PROCESSED_DATA_PATH}/env/gecko_daily_env.csv")
-        eth = eth.loc[eth["id"] == "ethereum", ["time", "daily_ret"]]
-        eth["time"] = pd.to_datetime(eth["time"])
+        eth = self.read(
+            "gecko_daily_env",
+            columns=["time", "daily_ret"],
+            filters=[("id", "==", "ethereum")],
+        )
         eth["time"] = eth["time"] - pd.Timedelta(days=7)
         eth.rename(columns={"daily_ret": "ETH"}, inplace=True)
 
@@ -2,25 +2,39 @@
 Class for the crypto market environment
 """
 
+import asyncio
 import json
 import os
 import pickle
+from functools import cache
 from typing import Any, Literal
 
-import matplotlib.pyplot as plt
 import numpy as np
-from IPython.display import clear_output
 from tqdm import tqdm
 
-from environ.agent import FTAgent
 from environ.constants import FIGURE_PATH, LABEL, PROCESSED_DATA_PATH
 from environ.env_datahander import DataHandler
 from environ.env_portfolio import Portfolio
-from environ.exhibits import plot_lin_scatter, port_fig, port_table
+from environ.record_store import RecordStore
 from environ.utils import boom_bust_split, port_eval, predict_explain_split
 
-# Initialize the portfolio
-portfolio = Portfolio()
+# Agent method used by each data type
+ACTION_METHODS = {
+    "cs": "predict_from_prompt",
+    "mkt": "predict_from_prompt",
+    "vision": "predict_from_image",
+    "news": "predict_from_prompt",
+    "cs_vision": "predict_from_prompt",
+    "mkt_news": "predict_from_prompt",
+}
+
+
+@cache
+def get_portfolio() -> Portfolio:
+    """
+    Function to get the portfolio shared by the environments
+    """
+    return Portfolio()
 
 
 class Environment:
@@ -36,7 +50,7 @@ class Environment:
         Initialize the environment with agent paths.
         """
         self.data_handler = DataHandler()
-        self.portfolio = portfolio
+        self.portfolio = get_portfolio()
         self.portfolio.rise_w = self.rise_w = rise_w
         self.portfolio.fall_w = self.fall_w = fall_w
         self.agents_path = agent_paths
@@ -47,6 +61,7 @@ class Environment:
         self.records = {
             name.removesuffix("_agent_path"): {} for name, _ in agent_paths.items()
         }
+        self.record_stores: dict[str, RecordStore] = {}
 
     def _load_agent(self, path: str) -> Any:
         """
@@ -57,8 +72,12 @@ class Environment:
 
     def load_record(self, record_type: str, path: str) -> None:
         """
-        Load a record from a JSON file.
+        Load a record from a JSON file or a JSONL record log.
         """
+        if str(path).endswith(".jsonl"):
+            self.records[record_type] = RecordStore.load(path)
+            return
+
         with open(path, "r", encoding="utf-8") as f:
             self.records[record_type] = json.load(f)
 
@@ -87,11 +106,7 @@ class Environment:
         Retrieve the state data based on data type.
         """
         data_sources = {
-            "ret": lambda: self.data_handler.env_data.loc[
-                (self.data_handler.env_data["year"] == year)
-                & (self.data_handler.env_data["week"] == week)
-                & (self.data_handler.env_data["name"] == crypto)
-            ],
+            "ret": lambda: self.data_handler.get_ret_state(year, week, crypto),
             "cs": lambda: self.data_handler.cs_test_data.get(f"{year}{week}", {}).get(
                 crypto
             ),
@@ -113,21 +128,21 @@ class Environment:
         """
         Get the action from the corresponding agent.
         """
-        # With Ensemble
-        if data_type in ["cs", "mkt", "vision", "news"]:
-            action_method = {
-                "cs": self.agents["cs"].predict_from_prompt,
-                "mkt": self.agents["mkt"].predict_from_prompt,
-                "vision": self.agents["vision"].predict_from_image,
-                "news": self.agents["news"].predict_from_prompt,
-            }
-        # Without Ensemble
-        else:
-            action_method = {
-                "cs_vision": self.agents["cs_vision"].predict_from_prompt,
-                "mkt_news": self.agents["mkt_news"].predict_from_prompt,
-            }
-        return action_method[data_type](state, log_probs=True, top_logprobs=10)
+        return getattr(self.agents[data_type], ACTION_METHODS[data_type])(
+            state, log_probs=True, top_logprobs=10
+        )
+
+    async def _aget_action(
+        self, state: Any, data_type: str, semaphore: asyncio.Semaphore
+    ) -> tuple:
+        """
+        Get the action from the corresponding agent without blocking,
+        keeping at most the semaphore's value of requests in flight.
+        """
+        async with semaphore:
+            return await getattr(
+                self.agents[data_type], f"a{ACTION_METHODS[data_type]}"
+            )(state, log_probs=True, top_logprobs=10)
 
     def _record_action(
         self,
@@ -142,6 +157,8 @@ class Environment:
         """
         Record the action and associated log probabilities.
         """
+        # market records are keyed by "null", as in the saved JSON records
+        crypto = crypto if crypto else "null"
         record = self.records[record_type]
         record.setdefault(f"{year}{week}", {}).setdefault(
             crypto, {"messages": state["messages"].copy()}
@@ -151,6 +168,11 @@ class Environment:
             {"role": "assistant", "content": log_prob},
         ]
 
+        if record_type in self.record_stores:
+            self.record_stores[record_type].append(
+                f"{year}{week}", crypto, record[f"{year}{week}"][crypto]
+            )
+
     def _collab(self, state: dict, year: str, week: str) -> dict:
         """
         Method to collaborate between market team and crypto team
@@ -185,16 +207,16 @@ trend for the upcoming week is {strength}. {explain}"
 
         return state
 
-    def _step(
+    def _prepare_step(
         self,
         year: str,
         week: str,
         data_type: Literal["cs", "mkt", "vision", "news", "cs_vision", "mkt_news"],
         crypto: str | None = None,
         collab: bool = False,
-    ) -> None:
+    ) -> tuple[Any, dict]:
         """
-        Perform a single step in the environment for a specific data type.
+        Collect the return state and the agent state for a single step.
         """
         ret_state = self._get_state("ret", year, week, crypto)
         state = self._get_state(data_type, year, week, crypto)
@@ -203,8 +225,22 @@ trend for the upcoming week is {strength}. {explain}"
             state = self._collab(state, year, week)
             print(state)
 
-        action, prob = self._get_action(state, data_type)
+        return ret_state, state
 
+    def _apply_step(
+        self,
+        year: str,
+        week: str,
+        data_type: Literal["cs", "mkt", "vision", "news", "cs_vision", "mkt_news"],
+        crypto: str | None,
+        ret_state: Any,
+        state: dict,
+        action: str,
+        prob: Any,
+    ) -> None:
+        """
+        Record the action of a single step and update the portfolio.
+        """
         if " " + LABEL[0] in [_.token for _ in prob[3].top_logprobs]:
             log_prob = [
                 p.logprob for p in prob[3].top_logprobs if p.token == " " + LABEL[0]
@@ -229,12 +265,36 @@ trend for the upcoming week is {strength}. {explain}"
             state_ret=ret_state,
         )
 
+    def _step(
+        self,
+        year: str,
+        week: str,
+        data_type: Literal["cs", "mkt", "vision", "news", "cs_vision", "mkt_news"],
+        crypto: str | None = None,
+        collab: bool = False,
+    ) -> None:
+        """
+        Perform a single step in the environment for a specific data type.
+        """
+        ret_state, state = self._prepare_step(year, week, data_type, crypto, collab)
+        action, prob = self._get_action(state, data_type)
+        self._apply_step(year, week, data_type, crypto, ret_state, state, action, prob)
+
     def _save_record(self, record_type: str, path: str) -> None:
         """
-        Save records to a JSON file.
+        Save records to a JSON file, replacing it only once fully written.
         """
-        with open(path, "w", encoding="utf-8") as f:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
             json.dump(self.records[record_type], f, indent=4)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _record_log_path(record_path: str) -> str:
+        """
+        Get the path of the JSONL record log of a run.
+        """
+        return os.path.splitext(str(record_path))[0] + ".jsonl"
 
     def run(
         self,
@@ -244,14 +304,77 @@ trend for the upcoming week is {strength}. {explain}"
         # For collaboration replay
         mkt_record_path: str | None = None,
         news_record_path: str | None = None,
+        concurrency: int | None = None,
+        across_weeks: bool = False,
     ) -> None:
         """
         Run the environment for a specific data type.
+
+        Every step is appended to a JSONL record log next to ``record_path``,
+        and the JSON record replaces the log once the run finishes. An
+        interrupted run resumes from its first incomplete week, skipping the
+        steps and the weeks already done.
+
+        With ``concurrency``, the agent requests are sent through the async
+        client with at most ``concurrency`` of them in flight. The steps of
+        each week are fanned out together (or the steps of every week with
+        ``across_weeks``) and applied week by week in the sequential order,
+        so the records and the portfolio are identical to a sequential run.
+        ``across_weeks`` is only for the agents without collaboration.
+        """
+
+        if across_weeks and collab and data_type in ["cs", "vision", "cs_vision"]:
+            raise ValueError("across_weeks is only for runs without collaboration")
+
+        done = self._start_run(
+            data_type, record_path, mkt_record_path, news_record_path
+        )
+
+        if concurrency:
+            asyncio.run(
+                self._arun(
+                    data_type,
+                    record_path,
+                    collab,
+                    done,
+                    concurrency,
+                    across_weeks,
+                )
+            )
+            self._finish_run(data_type, record_path)
+            return
+
+        # market team does not receive collaboration
+        collab = collab and data_type in ["cs", "vision", "cs_vision"]
+
+        for year, week in tqdm(self._pending_weeks(data_type, done)):
+            for crypto in self._pending_cryptos(year, week, data_type, done):
+                self._step(year, week, data_type, crypto, collab)
+
+            self._end_week(data_type)
+
+        self._finish_run(data_type, record_path)
+
+    def _start_run(
+        self,
+        data_type: Literal["cs", "mkt", "vision", "news", "cs_vision", "mkt_news"],
+        record_path: str,
+        mkt_record_path: str | None = None,
+        news_record_path: str | None = None,
+    ) -> set[tuple[str, str]]:
+        """
+        Load the records of a run, open its record log and collect the
+        (year-week, crypto) keys of the steps already done.
         """
 
-        # default record path
-        if os.path.exists(record_path):
+        # default record path, updated with the steps logged since it was saved
+        log_path = self._record_log_path(record_path)
+        if os.path.exists(record_path) and str(record_path) != log_path:
             self.load_record(data_type, record_path)
+        if os.path.exists(log_path):
+            for yw, info in RecordStore.load(log_path).items():
+                self.records[data_type].setdefault(yw, {}).update(info)
+        self.record_stores[data_type] = RecordStore(log_path)
 
         # interteam collaboration record collection
         if (mkt_record_path is not None) & (news_record_path is not None):
@@ -260,39 +383,239 @@ trend for the upcoming week is {strength}. {explain}"
         else:
             self.portfolio.reset()
 
-        fetch = True
-
-        yw_crypto_done_list = [
-            yw + crypto
+        return {
+            (yw, crypto)
             for yw, info in self.records[data_type].items()
-            for crypto, _ in info.items()
+            for crypto in info
+        }
+
+    def _pending_cryptos(
+        self,
+        year: str,
+        week: str,
+        data_type: Literal["cs", "mkt", "vision", "news", "cs_vision", "mkt_news"],
+        done: set[tuple[str, str]],
+    ) -> list[str | None]:
+        """
+        List the cryptos of a week not done yet, [None] for a pending market step.
+        """
+        cryptos = (
+            self.data_handler.get_crypto_list(year, week)
+            if data_type in ["cs", "vision", "cs_vision"]
+            else [None]
+        )
+
+        # market records are keyed by "null"
+        return [
+            crypto
+            for crypto in cryptos
+            if (f"{year}{week}", crypto if crypto else "null") not in done
         ]
 
-        for year, week in tqdm(self.data_handler.get_yw_list()):
-            cryptos = (
-                self.data_handler.get_crypto_list(year, week)
-                if data_type in ["cs", "vision", "cs_vision"]
-                else [None]
-            )
-            for crypto in cryptos:
-                if data_type in ["cs", "vision", "cs_vision"]:
-                    if year + week + str(crypto) in yw_crypto_done_list:
-                        fetch = False
-                        print(
-                            f"Skip fetching {year} {week} {crypto} data, already done"
-                        )
+    def _pending_weeks(
+        self,
+        data_type: Literal["cs", "mkt", "vision", "news", "cs_vision", "mkt_news"],
+        done: set[tuple[str, str]],
+    ) -> list[tuple[str, str]]:
+        """
+        List the weeks with steps not done yet, from the first incomplete week.
+        """
+        yw_list = self.data_handler.get_yw_list()
+        pending = [
+            (year, week)
+            for year, week in yw_list
+            if self._pending_cryptos(year, week, data_type, done)
+        ]
+
+        if len(pending) < len(yw_list):
+            print(f"Skip {len(yw_list) - len(pending)} weeks, already done")
+
+        return pending
+
+    def _pending_steps(
+        self,
+        yw_group: list[tuple[str, str]],
+        data_type: Literal["cs", "mkt", "vision", "news", "cs_vision", "mkt_news"],
+        collab: bool,
+        done: set[tuple[str, str]],
+    ) -> dict[tuple[str, str], list[tuple[str | None, Any, dict]]]:
+        """
+        Prepare the steps of the given weeks that are not done yet.
+        """
+
+        # market team does not receive collaboration
+        collab = collab and data_type in ["cs", "vision", "cs_vision"]
+
+        return {
+            (year, week): [
+                (crypto, *self._prepare_step(year, week, data_type, crypto, collab))
+                for crypto in self._pending_cryptos(year, week, data_type, done)
+            ]
+            for year, week in yw_group
+        }
+
+    def _end_week(
+        self,
+        data_type: Literal["cs", "mkt", "vision", "news", "cs_vision", "mkt_news"],
+    ) -> None:
+        """
+        Price the crypto portfolio and sync the record log after a fetched week.
+        """
+        from IPython.display import clear_output
+
+        if data_type in ["cs", "vision", "cs_vision"]:
+            self.portfolio.asset_pricing(data_type)
+            clear_output(wait=True)
+            self.record_stores[data_type].sync()
+
+    def _finish_run(
+        self,
+        data_type: Literal["cs", "mkt", "vision", "news", "cs_vision", "mkt_news"],
+        record_path: str,
+    ) -> None:
+        """
+        Close the record log of a run and save its JSON record, which then
+        replaces the log. A run recorded only in its log has the log compacted.
+        """
+        self.record_stores.pop(data_type).close()
+        log_path = self._record_log_path(record_path)
+        if str(record_path) == log_path:
+            RecordStore.compact(log_path)
+            return
+
+        self._save_record(data_type, record_path)
+        os.remove(log_path)
+
+    async def _arun(
+        self,
+        data_type: Literal["cs", "mkt", "vision", "news", "cs_vision", "mkt_news"],
+        record_path: str,
+        collab: bool,
+        done: set[tuple[str, str]],
+        concurrency: int,
+        across_weeks: bool = False,
+    ) -> None:
+        """
+        Run the environment with concurrent agent requests, applying and
+        logging each week in order as soon as its requests are done. A step
+        whose request fails is skipped and left pending for a rerun.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        yw_list = self._pending_weeks(data_type, done)
+        yw_groups = [yw_list] if across_weeks else [[yw] for yw in yw_list]
+        failed = 0
+
+        for yw_group in yw_groups:
+            week_steps = self._pending_steps(yw_group, data_type, collab, done)
+
+            # requests of every week of the group, in flight up to the semaphore
+            week_actions = {
+                yw: [
+                    asyncio.ensure_future(
+                        self._aget_action(state, data_type, semaphore)
+                    )
+                    for _, _, state in steps
+                ]
+                for yw, steps in week_steps.items()
+            }
+
+            # apply the actions in the sequential order
+            for (year, week), steps in tqdm(week_steps.items()):
+                actions = await asyncio.gather(
+                    *week_actions[year, week], return_exceptions=True
+                )
+                fetch = False
+                for (crypto, ret_state, state), result in zip(steps, actions):
+                    if isinstance(result, Exception):
+                        print(f"Request failed for {year} {week} {crypto}: {result}")
+                        failed += 1
                         continue
-                    else:
-                        fetch = True
-                else:
-                    # market team does not receive collaboration
-                    collab = False
-                self._step(year, week, data_type, crypto, collab)
+                    self._apply_step(
+                        year, week, data_type, crypto, ret_state, state, *result
+                    )
+                    fetch = True
 
-            if (data_type in ["cs", "vision", "cs_vision"]) & fetch:
-                self.portfolio.asset_pricing(data_type)
-                clear_output(wait=True)
-                self._save_record(data_type, record_path)
+                if fetch:
+                    self._end_week(data_type)
+
+        if failed:
+            print(f"{failed} steps failed, rerun to retry them")
+
+    def run_batch(
+        self,
+        data_type: Literal["cs", "mkt", "vision", "news", "cs_vision", "mkt_news"],
+        record_path: str,
+        batch_path: str,
+        collab: bool = False,
+        # For collaboration replay
+        mkt_record_path: str | None = None,
+        news_record_path: str | None = None,
+        poll_interval: int = 60,
+    ) -> None:
+        """
+        Run the environment through the OpenAI Batch API.
+
+        Every pending step of the test set is written to ``batch_path`` as a
+        batch JSONL, submitted and polled until the batch completes. The
+        results are then applied in the sequential order, so the records
+        have the same format as ``run`` and ``replay`` works unchanged.
+
+        The batch ID is kept next to ``batch_path`` until the results are
+        applied, so a rerun after an interruption resumes polling the same
+        batch instead of submitting it again. The steps that failed in the
+        batch stay pending for the next run.
+        """
+
+        done = self._start_run(
+            data_type, record_path, mkt_record_path, news_record_path
+        )
+        week_steps = self._pending_steps(
+            self._pending_weeks(data_type, done), data_type, collab, done
+        )
+
+        agent = self.agents[data_type]
+        if not any(week_steps.values()):
+            # an empty input file is rejected by the Batch API
+            print("No pending steps, nothing to submit")
+            self._finish_run(data_type, record_path)
+            agent.clear_batch(batch_path)
+            return
+
+        vision = ACTION_METHODS[data_type] == "predict_from_image"
+        if not os.path.exists(agent.batch_id_path(batch_path)):
+            os.makedirs(os.path.dirname(batch_path) or ".", exist_ok=True)
+            with open(batch_path, "w", encoding="utf-8") as f:
+                for (year, week), steps in week_steps.items():
+                    for crypto, _, state in steps:
+                        request = agent.batch_request(
+                            f"{data_type}-{year}{week}-{crypto}",
+                            state,
+                            vision=vision,
+                            log_probs=True,
+                            top_logprobs=10,
+                        )
+                        f.write(json.dumps(request) + "\n")
+
+        results = agent.batch_results(agent.submit_batch(batch_path), poll_interval)
+
+        # apply the results in the sequential order
+        for (year, week), steps in tqdm(week_steps.items()):
+            fetch = False
+            for crypto, ret_state, state in steps:
+                result = results.get(f"{data_type}-{year}{week}-{crypto}")
+                if result is None:
+                    print(f"No batch result for {year} {week} {crypto}")
+                    continue
+                self._apply_step(
+                    year, week, data_type, crypto, ret_state, state, *result
+                )
+                fetch = True
+
+            if fetch:
+                self._end_week(data_type)
+
+        self._finish_run(data_type, record_path)
+        agent.clear_batch(batch_path)
 
     def _process_replay(
         self,
@@ -355,6 +678,8 @@ trend for the upcoming week is {strength}. {explain}"
         """
         Replay the record
         """
+        from environ.exhibits import port_fig
+
         self.portfolio.reset()
 
         # load the records
@@ -442,7 +767,7 @@ trend for the upcoming week is {strength}. {explain}"
             weekly=True,
         )
         # port_table(port_eval_res)
-        portfolio.eval.record_cum_sr(
+        self.portfolio.eval.record_cum_sr(
             self.rise_w,
             self.fall_w,
             port_eval_res[0]["Long"]["Long_cum"],
@@ -464,8 +789,8 @@ trend for the upcoming week is {strength}. {explain}"
         ):
             ap_table_data[data_name] = self.portfolio.asset_pricing_table(data_type)
 
-        portfolio.eval.record_ap(ap_table_data)
-        portfolio.eval.store_ap()
+        self.portfolio.eval.record_ap(ap_table_data)
+        self.portfolio.eval.store_ap()
 
         # # Display the disagreement
         # self.portfolio.mad()
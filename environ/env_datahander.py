@@ -2,10 +2,30 @@
 Data handler for the environment
 """
 
-from typing import Any, Dict, List, Tuple
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
+
+import pandas as pd
 
 from environ.data_loader import DataLoader
-from environ.prompt_generator import PromptGenerator
+from environ.prompt_cache import load_prompts
+
+if TYPE_CHECKING:
+    from environ.prompt_generator import PromptGenerator
+
+# Period of the test sets
+TEST_START_DATE = "2023-11-01"
+TEST_END_DATE = "2026-02-28"
+
+# Test sets: the prompts they are built from and their prompt parameters
+TEST_SETS = {
+    "cs": ("cs", {}),
+    "vision": ("cs", {"data_type": "vision", "strategy": "image_url"}),
+    "cs_vision": ("cs", {"data_type": "both"}),
+    "mkt": ("mkt", {}),
+    "news": ("mkt", {"data_type": "text", "strategy": "news"}),
+    "mkt_news": ("mkt", {"data_type": "both", "strategy": ["attn", "net", "news"]}),
+}
 
 
 class DataHandler:
@@ -15,106 +35,119 @@ class DataHandler:
 
     def __init__(self):
         self.dl = DataLoader()
-        self.pg = PromptGenerator()
         self.env_data = self.dl.get_env_data()
+        self.env_index = self.build_env_index()
         self.cmkt_data = self.dl.get_cmkt_data()
-        self.cs_test_data = self.load_cs_test_data()
-        self.mkt_test_data = self.load_mkt_test_data()
-        self.vision_test_data = self.load_vision_test_data()
-        self.news_test_data = self.load_news_test_data()
-        self.mkt_news_test_data = self.load_mkt_news_test_data()
-        self.cs_vision_test_data = self.load_cs_vision_test_data()
 
-    def load_cs_test_data(self) -> Dict[Any, Any]:
+    @cached_property
+    def pg(self) -> "PromptGenerator":
+        """
+        Prompt generator, only needed to build the uncached test sets
+        """
+        from environ.prompt_generator import PromptGenerator
+
+        return PromptGenerator()
+
+    def build_env_index(self) -> Dict[Tuple[str, str, str], slice]:
+        """
+        Sort the environment data and index the rows of each crypto-week
+        """
+
+        # A stable sort keeps the daily order within each crypto-week
+        self.env_data = self.env_data.sort_values(
+            ["year", "week", "name"], kind="stable"
+        )
+
+        return {
+            key: slice(rows[0], rows[-1] + 1)
+            for key, rows in self.env_data.groupby(
+                ["year", "week", "name"], sort=False
+            ).indices.items()
+        }
+
+    def get_ret_state(self, year: str, week: str, crypto: str | None) -> pd.DataFrame:
         """
-        Load the cross-sectional test set
+        Get the daily returns of a cryptocurrency in a year-week
         """
-        cs_test = {}
-        for yw, crypto, line in self.pg.get_cs_prompt(
-            start_date="2023-11-01",
-            end_date="2026-02-28",
-            train_test="test",
-        ):
-            cs_test.setdefault(yw, {})[crypto] = line
 
-        return cs_test
+        rows = self.env_index.get((year, week, crypto))
+        if rows is None:
+            return self.env_data.iloc[0:0]
 
-    def load_vision_test_data(self) -> Dict:
+        return self.env_data.iloc[rows]
+
+    def build_test_data(self, kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Load the vision test set
+        Build a test set from the prompt generator, keyed by year-week and,
+        for the cross-sectional sets, by crypto
         """
-        vision_test = {}
-        for yw, crypto, line in self.pg.get_cs_prompt(
-            data_type="vision",
-            strategy="image_url",
-            start_date="2023-11-01",
-            end_date="2026-02-28",
-            train_test="test",
-        ):
-            vision_test.setdefault(yw, {})[crypto] = line
+        test_data = {}
+        if kind == "cs":
+            for yw, crypto, line in self.pg.get_cs_prompt(**params):
+                test_data.setdefault(yw, {})[crypto] = line
+        else:
+            for yw, line in self.pg.get_mkt_prompt(**params):
+                test_data[yw] = line
 
-        return vision_test
+        return test_data
 
-    def load_cs_vision_test_data(self) -> Dict:
+    def load_test_data(self, name: str) -> Dict[str, Any]:
         """
-        Load the cross-sectional vision test set
+        Load a test set from the prompt cache, building it on a miss
         """
-        cs_vision_test = {}
-        for yw, crypto, line in self.pg.get_cs_prompt(
-            data_type="both",
-            start_date="2023-11-01",
-            end_date="2026-02-28",
-            train_test="test",
-        ):
-            cs_vision_test.setdefault(yw, {})[crypto] = line
+        kind, params = TEST_SETS[name]
+        params = {
+            "start_date": TEST_START_DATE,
+            "end_date": TEST_END_DATE,
+            "train_test": "test",
+            **params,
+        }
 
-        return cs_vision_test
+        return load_prompts(
+            name, kind, params, lambda: self.build_test_data(kind, params)
+        )
 
-    def load_mkt_test_data(self) -> Dict:
+    @cached_property
+    def cs_test_data(self) -> Dict[str, Any]:
         """
-        Load the market test set
+        Cross-sectional test set
         """
-        mkt_test = {}
-        for yw, line in self.pg.get_mkt_prompt(
-            start_date="2023-11-01",
-            end_date="2026-02-28",
-            train_test="test",
-        ):
-            mkt_test[yw] = line
+        return self.load_test_data("cs")
 
-        return mkt_test
+    @cached_property
+    def vision_test_data(self) -> Dict[str, Any]:
+        """
+        Vision test set
+        """
+        return self.load_test_data("vision")
 
-    def load_news_test_data(self) -> Dict:
+    @cached_property
+    def cs_vision_test_data(self) -> Dict[str, Any]:
         """
-        Load the news test set
+        Cross-sectional vision test set
         """
-        news_test = {}
-        for yw, line in self.pg.get_mkt_prompt(
-            data_type="text",
-            strategy="news",
-            start_date="2023-11-01",
-            end_date="2026-02-28",
-            train_test="test",
-        ):
-            news_test[yw] = line
+        return self.load_test_data("cs_vision")
 
-        return news_test
+    @cached_property
+    def mkt_test_data(self) -> Dict[str, Any]:
+        """
+        Market test set
+        """
+        return self.load_test_data("mkt")
 
-    def load_mkt_news_test_data(self) -> Dict:
+    @cached_property
+    def news_test_data(self) -> Dict[str, Any]:
         """
-        Load the market news test set
+        News test set
         """
-        mkt_news_test = {}
-        for yw, line in self.pg.get_mkt_prompt(
-            data_type="both",
-            strategy=["attn", "net", "news"],
-            start_date="2023-11-01",
-            end_date="2026-02-28",
-            train_test="test",
-        ):
-            mkt_news_test[yw] = line
+        return self.load_test_data("news")
 
-        return mkt_news_test
+    @cached_property
+    def mkt_news_test_data(self) -> Dict[str, Any]:
+        """
+        Market news test set
+        """
+        return self.load_test_data("mkt_news")
 
     def get_yw_list(self) -> List[Tuple[str, str]]:
         """
@@ -2,11 +2,11 @@
 Portfolio class to keep track of the portfolio
 """
 
+from functools import cached_property
 from typing import Dict, Literal
 
 import numpy as np
 import pandas as pd
-from sklearn.metrics import accuracy_score, matthews_corrcoef
 
 from environ.constants import AP_LABEL
 from environ.data_loader import DataLoader
@@ -16,22 +16,88 @@ from environ.utils import port_eval
 # initialize the evaluator
 eval = Evaluator()
 
+
+class BufferedFrame:
+    """
+    Portfolio component accumulating its updates in an append buffer and
+    materialising the sorted DataFrame only when it is read
+    """
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.name = name
+        self.buffer = f"_{name}_buffer"
+
+    def __get__(self, obj: object, objtype: type | None = None) -> pd.DataFrame:
+        if obj is None:
+            return self
+
+        buffer = obj.__dict__[self.buffer]
+        if buffer:
+            # The multi-key sort is stable, so the rows keep their update order
+            obj.__dict__[self.name] = pd.concat(
+                [obj.__dict__[self.name], *buffer]
+            ).sort_values(["year", "week", "name"], ascending=True)
+            buffer.clear()
+
+        return obj.__dict__[self.name]
+
+    def __set__(self, obj: object, value: pd.DataFrame) -> None:
+        obj.__dict__[self.name] = value
+        obj.__dict__[self.buffer] = []
+
+    def append(self, obj: object, rows: pd.DataFrame) -> None:
+        """
+        Method to buffer the rows of an update
+        """
+        obj.__dict__[self.buffer].append(rows)
+
+
 class Portfolio:
     """
     Portfolio class to keep track of the portfolio
     """
 
+    cs = BufferedFrame()
+    vision = BufferedFrame()
+    mkt = BufferedFrame()
+    news = BufferedFrame()
+    cs_vision = BufferedFrame()
+    mkt_news = BufferedFrame()
+
     def __init__(self) -> None:
         self.reset()
-        data_loader = DataLoader()
         self.rise_w = 1.0
         self.fall_w = 0.5
-        self.btc = data_loader.get_btc_data()
-        self.eth = data_loader.get_eth_data()
-        self.cmkt = data_loader.get_cmkt_data()
-        self.n = data_loader.get_n_data()
         self.eval = eval
 
+    @cached_property
+    def btc(self) -> pd.DataFrame:
+        """
+        Bitcoin benchmark returns, loaded on first use
+        """
+        return DataLoader().get_btc_data()
+
+    @cached_property
+    def eth(self) -> pd.DataFrame:
+        """
+        Ethereum benchmark returns, loaded on first use
+        """
+        return DataLoader().get_eth_data()
+
+    @cached_property
+    def cmkt(self) -> pd.DataFrame:
+        """
+        Market benchmark returns, loaded on first use
+        """
+        return DataLoader().get_cmkt_data()
+
+    @cached_property
+    def n(self) -> pd.DataFrame:
+        """
+        1/N benchmark returns, loaded on first use
+        """
+        return DataLoader().get_n_data()
+
     def reset(self) -> None:
         """
         Method to reset the portfolio
@@ -41,9 +107,11 @@ class Portfolio:
         for attr in components + [f"{x}_ret" for x in components]:
             setattr(self, attr, pd.DataFrame())
 
+        # year-weeks already priced into each {component}_ret
+        self.priced_weeks = {component: set() for component in components}
+
     def _update(
         self,
-        df: pd.DataFrame,
         year: str,
         week: str,
         strength: str,
@@ -53,7 +121,7 @@ class Portfolio:
         state_ret: pd.DataFrame | None = None,
     ) -> pd.DataFrame:
         """
-        Utility to update and sort portfolio components
+        Utility to build the rows of a portfolio update
         """
 
         new_data = pd.DataFrame(
@@ -73,9 +141,7 @@ class Portfolio:
                 state_ret, on=["year", "week", "name"], how="right"
             )
 
-        return pd.concat([df, new_data]).sort_values(
-            ["year", "week", "name"], ascending=True
-        )
+        return new_data
 
     def update(
         self, component: Literal["cs", "vision", "mkt", "news", "cs_vision", "mkt_news"], **kwargs
@@ -84,7 +150,26 @@ class Portfolio:
         Generic method to update the portfolio
         """
 
-        setattr(self, component, self._update(getattr(self, component), **kwargs))
+        getattr(Portfolio, component).append(self, self._update(**kwargs))
+
+    @staticmethod
+    def assign_quintiles(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Method to sort the rows of each year-week into probability quintiles
+        """
+
+        # Rank the rows by probability within each year-week, ties keep the
+        # component order, and drop the remainder above the last full quintile
+        df = df.sort_values(["year", "week", "lin_prob"], kind="stable")
+        group = df.groupby(["year", "week"])
+        n = group["lin_prob"].transform("size").to_numpy() // len(AP_LABEL)
+        bucket = group.cumcount().to_numpy() // np.maximum(n, 1)
+        keep = (n > 0) & (bucket < len(AP_LABEL))
+
+        df = df.loc[keep].reset_index(drop=True)
+        df["quitiles"] = np.array(AP_LABEL)[bucket[keep]]
+
+        return df
 
     def _asset_pricing(
         self,
@@ -96,63 +181,27 @@ class Portfolio:
         Utility to implement the asset pricing
         """
 
-        dfq = pd.DataFrame()
-        df.sort_values(["year", "week"], ascending=True, inplace=True)
-        for idx, dfyw in df.groupby(["year", "week"]):
-            dfyw.sort_values("lin_prob", ascending=True, inplace=True)
-            dfyw.reset_index(drop=True, inplace=True)
-            n = dfyw.shape[0] // len(AP_LABEL)
-            for i, q in enumerate(AP_LABEL):
-                df_label = dfyw.iloc[i * n : (i + 1) * n]
-                df_label["quitiles"] = q
-                df_label["year"] = idx[0]
-                df_label["week"] = idx[1]
-                dfq = pd.concat([dfq, df_label])
-
-        df = dfq.copy()
+        df = self.assign_quintiles(df)
 
+        # Weighted mean of the daily returns in each quintile
         match port_method:
-            case "equal": 
-                df_port = (
-                    (
-                        df.copy()
-                        .groupby(["time", "quitiles"])["daily_ret"]
-                        .mean()
-                        .reset_index()
-                        .pivot(index="time", columns="quitiles", values="daily_ret")
-                    )
-                    .reset_index()
-                )
+            case "equal":
+                df["weight"] = df["daily_ret"].notna().astype(float)
             case "mcap":
-                df["mcap_ret"] = df["daily_ret"] * df["market_caps"]
-                df_port = (
-                    (
-                        df.copy()
-                        .groupby(["time", "quitiles"])
-                        .agg({"market_caps": "sum", "mcap_ret": "sum"})
-                        .reset_index()
-                    )
-                )
-                df_port["daily_ret"] = df_port["mcap_ret"] / df_port["market_caps"]
-                df_port = (
-                    df_port.pivot(index="time", columns="quitiles", values="daily_ret")
-                    .reset_index()
-                )
+                df["weight"] = df["market_caps"]
             case "prob":
-                df["prob_ret"] = df["daily_ret"] * df["lin_prob"]
-                df_port = (
-                    (
-                        df.copy()
-                        .groupby(["time", "quitiles"])
-                        .agg({"lin_prob": "sum", "prob_ret": "sum"})
-                        .reset_index()
-                    )
-                )
-                df_port["daily_ret"] = df_port["prob_ret"] / df_port["lin_prob"]
-                df_port = (
-                    df_port.pivot(index="time", columns="quitiles", values="daily_ret")
-                    .reset_index()
-                )
+                df["weight"] = df["lin_prob"]
+        df["weight_ret"] = df["daily_ret"] * df["weight"]
+
+        df_port = (
+            df.groupby(["time", "quitiles"])[["weight", "weight_ret"]]
+            .sum()
+            .reset_index()
+        )
+        df_port["daily_ret"] = df_port["weight_ret"] / df_port["weight"]
+        df_port = df_port.pivot(
+            index="time", columns="quitiles", values="daily_ret"
+        ).reset_index()
 
         df_port["Long"] = df_port["Very High"]
         df_port["HML"] = df_port["Very High"] - df_port["Very Low"]
@@ -207,15 +256,38 @@ class Portfolio:
 
     def asset_pricing(self, component: str) -> None:
         """
-        Method to implement the asset pricing
+        Method to implement the asset pricing of the year-weeks not priced yet
         """
 
+        df = getattr(self, component)
+        if df.empty:
+            return
+
+        # The daily returns of a year-week never overlap with another year-week,
+        # so pricing only the new weeks matches a full recomputation
+        priced = self.priced_weeks[component]
+        yw = pd.MultiIndex.from_frame(df[["year", "week"]])
+        new_weeks = set(yw) - priced
+        if not new_weeks:
+            return
+
+        df_new = df.loc[yw.isin(list(new_weeks))].copy()
+        priced.update(new_weeks)
+
+        # Weeks with fewer cryptos than quintiles get no portfolio
+        if (df_new.groupby(["year", "week"]).size() < len(AP_LABEL)).all():
+            return
+
+        df_ret = getattr(self, f"{component}_ret")
+        df_new_ret = self._asset_pricing(df_new, df_ret)
+        if not df_ret.empty:
+            df_new_ret = pd.concat([df_ret, df_new_ret])
+
         setattr(
             self,
             f"{component}_ret",
-            self._asset_pricing(
-                getattr(self, component),
-                getattr(self, f"{component}_ret"),
+            df_new_ret.sort_values("time", ascending=True, kind="stable").reset_index(
+                drop=True
             ),
         )
 
@@ -225,6 +297,7 @@ class Portfolio:
         """
         Method to evaluate the portfolio
         """
+        from sklearn.metrics import accuracy_score, matthews_corrcoef
 
         return {
             "ACC": accuracy_score(df[truth_col], df[pred_col]),
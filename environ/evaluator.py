@@ -3,6 +3,7 @@ Class to evaluate portfolio performance
 """
 
 import json
+from functools import cached_property
 
 import pandas as pd
 import numpy as np
@@ -11,8 +12,6 @@ from environ.constants import PROCESSED_DATA_PATH
 from environ.utils import msd
 from environ.data_loader import DataLoader
 
-dl = DataLoader()
-
 
 class Evaluator:
     """
@@ -29,9 +28,15 @@ class Evaluator:
         self.cs_agg = []
         self.mkt_agg = []
         self.mkt_res = []
-        self.cmkt = pd.read_csv(PROCESSED_DATA_PATH / "market" / "cmkt.csv")
         self.cum_sr_fall_w = {"rise_w": [], "fall_w": [], "cum_ret": [], "sr": []}
 
+    @cached_property
+    def cmkt(self) -> pd.DataFrame:
+        """
+        Crypto market returns, read on first use
+        """
+        return DataLoader.read("cmkt")
+
     def cal_msd(self, df: pd.DataFrame, col1: str, col2: str) -> None:
         """
         Calculate the mean squared deviation
@@ -0,0 +1,303 @@
+"""
+Streaming reader and writer of JSONL files, plain or zstd-compressed
+"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+import tempfile
+from pathlib import Path
+from typing import IO, Any, Iterable, Iterator
+
+from environ.constants import JSONL_SHUFFLE_BUCKETS
+
+# Files with this suffix are compressed with zstd
+ZSTD_SUFFIX = ".zst"
+
+
+def is_compressed(path: str | Path) -> bool:
+    """
+    Function to check whether a JSONL file is compressed
+    """
+    return str(path).endswith(ZSTD_SUFFIX)
+
+
+def open_jsonl(path: str | Path, mode: str = "r", compressed: bool | None = None) -> IO:
+    """
+    Function to open a JSONL file as text, through zstd when compressed
+    """
+    if compressed is None:
+        compressed = is_compressed(path)
+    if compressed:
+        import zstandard
+
+        return zstandard.open(path, mode, encoding="utf-8")
+
+    return open(path, mode, encoding="utf-8")
+
+
+def read_jsonl(path: str | Path) -> Iterator[Any]:
+    """
+    Function to read the records of a JSONL file one line at a time, skipping
+    a last line cut short by a crash
+    """
+    with open_jsonl(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # only the last line can lack its newline
+                if not line.endswith("\n"):
+                    logging.warning("Skipped a truncated line in %s", path)
+                    return
+                raise
+
+
+def count_jsonl(path: str | Path) -> int:
+    """
+    Function to count the records of a JSONL file without parsing them
+    """
+    with open_jsonl(path) as f:
+        return sum(1 for line in f if line.strip())
+
+
+def drop_truncated_tail(path: str | Path) -> bool:
+    """
+    Function to cut a line left incomplete by a crash off a plain JSONL file,
+    reading back from its end only as far as the last newline
+    """
+    if is_compressed(path):
+        raise ValueError(f"Cannot repair a compressed JSONL file in place: {path}")
+    if not os.path.exists(path):
+        return False
+
+    with open(path, "rb+") as f:
+        size = end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(end - (1 << 16), 0)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+
+        if end == size:
+            return False
+        f.truncate(end)
+    logging.warning("Dropped a truncated line in %s", path)
+
+    return True
+
+
+def resume_jsonl(path: str | Path) -> int:
+    """
+    Function to get a JSONL file left by a crash ready to be appended to,
+    returning how many records it keeps, rewriting a compressed file with the
+    records that decode as new data cannot follow a frame cut short
+    """
+    if not os.path.exists(path):
+        return 0
+    if is_compressed(path):
+        return write_jsonl(path, read_jsonl(path))
+
+    drop_truncated_tail(path)
+
+    return count_jsonl(path)
+
+
+def record_digest(record: Any) -> bytes:
+    """
+    Function to hash the content of a record, regardless of its key order
+    """
+    return hashlib.blake2b(
+        json.dumps(record, sort_keys=True, separators=(",", ":")).encode("utf-8"),
+        digest_size=16,
+    ).digest()
+
+
+def unique(records: Iterable[Any]) -> Iterator[Any]:
+    """
+    Function to drop the records whose content was already seen, keeping a
+    16-byte digest per distinct record
+    """
+    seen = set()
+    for record in records:
+        digest = record_digest(record)
+        if digest not in seen:
+            seen.add(digest)
+            yield record
+
+
+def batched(records: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    """
+    Function to group records into lists of a given size, the last one shorter
+    """
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class JsonlWriter:
+    """
+    Line-by-line JSONL writer, replacing the file only once all lines are
+    written, or appending to it
+    """
+
+    def __init__(
+        self, path: str | Path, append: bool = False, fsync: bool = False
+    ) -> None:
+        self.path = str(path)
+        self.append = append
+        self.fsync = fsync
+        self.count = 0
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._write_path = self.path if append else f"{self.path}.tmp"
+        self._file = open_jsonl(
+            self._write_path, "a" if append else "w", is_compressed(self.path)
+        )
+
+    def write(self, record: Any) -> None:
+        """
+        Method to write a record as a line
+        """
+        self._file.write(json.dumps(record) + "\n")
+        self.count += 1
+
+    def write_all(self, records: Iterable[Any]) -> int:
+        """
+        Method to write records as lines, returning how many were written
+        """
+        for record in records:
+            self.write(record)
+
+        return self.count
+
+    def flush(self) -> None:
+        """
+        Method to flush the written lines
+        """
+        self._file.flush()
+
+    def close(self, commit: bool = True) -> None:
+        """
+        Method to close the file, moving it into place unless discarded, and
+        syncing it to disk first if asked
+        """
+        if self._file.closed:
+            return
+
+        if commit and self.fsync:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._file.close()
+        if self.append:
+            return
+        if commit:
+            os.replace(self._write_path, self.path)
+        else:
+            os.remove(self._write_path)
+
+    def __enter__(self) -> "JsonlWriter":
+        return self
+
+    def __exit__(self, exc_type: Any, *args: Any) -> None:
+        self.close(commit=exc_type is None)
+
+
+def write_jsonl(path: str | Path, records: Iterable[Any], dedup: bool = False) -> int:
+    """
+    Function to write records to a JSONL file, returning how many were written
+    """
+    with JsonlWriter(path) as writer:
+        return writer.write_all(unique(records) if dedup else records)
+
+
+def merge(paths: Iterable[str | Path], path: str | Path, dedup: bool = True) -> int:
+    """
+    Function to concatenate JSONL files into one, dropping duplicate records
+    """
+    return write_jsonl(
+        path, (record for src in paths for record in read_jsonl(src)), dedup=dedup
+    )
+
+
+def shuffle(
+    paths: Iterable[str | Path],
+    path: str | Path,
+    seed: int = 0,
+    buckets: int = JSONL_SHUFFLE_BUCKETS,
+    dedup: bool = False,
+) -> int:
+    """
+    Function to shuffle the records of JSONL files into one, scattering them
+    across temporary buckets at random and shuffling each bucket in memory
+    """
+    rng = random.Random(seed)
+    records = (record for src in paths for record in read_jsonl(src))
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(path) or ".") as tmp_dir:
+        bucket_paths = [os.path.join(tmp_dir, f"{i}.jsonl") for i in range(buckets)]
+        bucket_files = [open(p, "w", encoding="utf-8") for p in bucket_paths]
+        try:
+            for record in unique(records) if dedup else records:
+                rng.choice(bucket_files).write(json.dumps(record) + "\n")
+        finally:
+            for f in bucket_files:
+                f.close()
+
+        with JsonlWriter(path) as writer:
+            for bucket_path in bucket_paths:
+                with open(bucket_path, "r", encoding="utf-8") as f:
+                    lines = f.readlines()
+                rng.shuffle(lines)
+                for line in lines:
+                    writer.write(json.loads(line))
+
+    return writer.count
+
+
+def split(
+    path: str | Path, fractions: dict[str | Path, float], seed: int = 0
+) -> dict[str, int]:
+    """
+    Function to split a JSONL file into several by the content hash of each
+    record, so a record stays in the same file as the input grows
+    """
+    if abs(sum(fractions.values()) - 1) > 1e-9:
+        raise ValueError(f"Split fractions do not sum to 1: {fractions}")
+
+    bounds = []
+    cumulative = 0.0
+    for out_path, fraction in fractions.items():
+        cumulative += fraction
+        bounds.append((cumulative, str(out_path)))
+
+    writers = {out_path: JsonlWriter(out_path) for _, out_path in bounds}
+    salt = seed.to_bytes(8, "little", signed=True)
+    try:
+        for record in read_jsonl(path):
+            digest = hashlib.blake2b(record_digest(record) + salt, digest_size=8)
+            position = int.from_bytes(digest.digest(), "little") / 2**64
+            out_path = next(
+                (p for bound, p in bounds if position < bound), bounds[-1][1]
+            )
+            writers[out_path].write(record)
+    except BaseException:
+        for writer in writers.values():
+            writer.close(commit=False)
+        raise
+    for writer in writers.values():
+        writer.close()
+
+    return {out_path: writer.count for out_path, writer in writers.items()}
@@ -0,0 +1,115 @@
+"""
+On-disk cache of the materialised test-set prompts
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Iterable
+
+from environ import constants, instructions, prompts
+from environ.constants import DATA_PATH, PROMPT_CACHE_PATH
+from environ.storage import stored_path
+
+# Files the prompts of each kind of test set are built from
+PROMPT_INPUTS = {
+    "cs": lambda: [stored_path("gecko_signal")],
+    "mkt": lambda: [
+        stored_path("cmkt"),
+        DATA_PATH / "blockchain" / "n-unique-addresses.json",
+        DATA_PATH / "btc.csv",
+        DATA_PATH / "attn_btc.csv",
+        DATA_PATH / "attn_crypto.csv",
+        DATA_PATH / "cointelegraph.csv",
+    ],
+}
+
+# Constants rendered into the prompts besides the instructions and prompts
+PROMPT_CONSTANTS = [
+    "CROSS_SECTIONAL_CRYPTO_NUMBER",
+    "CS_FACTOR_DESCRIPTION_MAPPING",
+    "MKT_FACTOR_DESCRIPTION_MAPPING",
+    "IMAGE_URL_TEMP",
+]
+
+
+def file_digest(path: str | Path) -> str:
+    """
+    Function to hash the content of a file, or mark it as missing
+    """
+    if not os.path.exists(path):
+        return "missing"
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def template_digest(modules: Iterable[ModuleType] = (instructions, prompts)) -> str:
+    """
+    Function to hash the instruction and prompt templates
+    """
+    templates = {
+        f"{module.__name__}.{name}": value
+        for module in modules
+        for name, value in vars(module).items()
+        if name.isupper() and isinstance(value, str)
+    }
+    templates.update({name: getattr(constants, name) for name in PROMPT_CONSTANTS})
+
+    return hashlib.sha256(
+        json.dumps(templates, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def cache_key(kind: str, params: dict[str, Any]) -> str:
+    """
+    Function to get the cache key of a test set from its inputs, parameters
+    and templates
+    """
+    key = {
+        "kind": kind,
+        "params": params,
+        "inputs": {str(path): file_digest(path) for path in PROMPT_INPUTS[kind]()},
+        "templates": template_digest(),
+    }
+
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_prompts(
+    name: str,
+    kind: str,
+    params: dict[str, Any],
+    build: Callable[[], dict[str, Any]],
+    cache_dir: str | Path = PROMPT_CACHE_PATH,
+) -> dict[str, Any]:
+    """
+    Function to load a test set from the cache, building and caching it when
+    its inputs, parameters or templates changed
+    """
+    path = Path(cache_dir) / name / f"{cache_key(kind, params)}.json"
+    if path.exists():
+        logging.info("Loading the %s test set from %s", name, path)
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    data = build()
+
+    os.makedirs(path.parent, exist_ok=True)
+    for stale in path.parent.glob("*.json"):
+        stale.unlink()
+
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+    logging.info("Cached the %s test set in %s", name, path)
+
+    return data
@@ -3,12 +3,14 @@ Prompt generator
 """
 
 import logging
-from typing import Any, Generator, Literal
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Generator, Literal
 
 import pandas as pd
 
-from environ.agent import OpenAIAgent
-from environ.constants import CROSS_SECTIONAL_CRYPTO_NUMBER
+from environ.agent import OpenAIAgent, TokenUsage
+from environ.constants import ANNOTATION_CONCURRENCY, CROSS_SECTIONAL_CRYPTO_NUMBER
 from environ.data_loader import DataLoader
 from environ.instructions import (AGENT_ANNOTATION_INSTRUCTION,
                                   CROSS_SECTIONAL_INSTRUCTION,
@@ -16,14 +18,22 @@ from environ.instructions import (AGENT_ANNOTATION_INSTRUCTION,
                                   MARKET_INSTRUCTION,
                                   MARKET_PLUS_NEWS_INSTRUCTION,
                                   NEWS_INSTRUCTION, VISION_INSTRUCTION)
+from environ.jsonl import JsonlWriter, resume_jsonl
 from environ.prompts import (ANSWER, CROSS_SECTIONAL_ANNOTATION_PROMPT,
+                             CROSS_SECTIONAL_CACHED_ANNOTATION_PROMPT,
                              CROSS_SECTIONAL_PLUS_VISION_ANNOTATION_PROMPT,
+                             CROSS_SECTIONAL_PLUS_VISION_CACHED_ANNOTATION_PROMPT,
                              CROSS_SECTIONAL_PLUS_VISION_PROMPT,
                              CROSS_SECTIONAL_PROMPT, MARKET_ANNOTATION_PROMPT,
+                             MARKET_CACHED_ANNOTATION_PROMPT,
                              MARKET_PLUS_NEWS_ANNOTATION_PROMPT,
+                             MARKET_PLUS_NEWS_CACHED_ANNOTATION_PROMPT,
                              MARKET_PLUS_NEWS_PROMPT, MARKET_PROMPT,
-                             NEWS_ANNOTATION_PROMPT, NEWS_PROMPT,
-                             VISION_ANNOTATION_PROMPT, VISION_PROMPT)
+                             NEWS_ANNOTATION_PROMPT,
+                             NEWS_CACHED_ANNOTATION_PROMPT, NEWS_PROMPT,
+                             VISION_ANNOTATION_PROMPT,
+                             VISION_CACHED_ANNOTATION_PROMPT, VISION_PROMPT)
+from environ.templates import Template
 from environ.utils import predict_explain_split
 
 logging.basicConfig(
@@ -32,8 +42,6 @@ logging.basicConfig(
     handlers=[logging.StreamHandler()],
 )
 
-dl = DataLoader()
-
 
 class PromptGenerator:
     """
@@ -43,6 +51,7 @@ class PromptGenerator:
     def __init__(self, model: str = "gpt-4o-2024-08-06") -> None:
         self.agent = OpenAIAgent(model=model)
         self.data_loader = DataLoader()
+        self.train_yw = {}
 
     @staticmethod
     def _generate_ft_prompt(
@@ -82,36 +91,109 @@ class PromptGenerator:
             {"role": "assistant", "content": assistant_content},
         ]
 
+    def _annotate(
+        self,
+        steps: list[tuple],
+        request: Callable[..., dict[str, Any]],
+        concurrency: int = 1,
+        skip: int = 0,
+    ) -> Generator:
+        """
+        Method to get the agent explanation of each step after the first skip
+        ones, with at most concurrency requests in flight, in the step order
+        """
+        usage = TokenUsage()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            in_flight = deque()
+            for step_counter, step in enumerate(steps[skip:], skip + 1):
+                if len(in_flight) == concurrency:
+                    done, future = in_flight.popleft()
+                    yield done, future.result()
+
+                logging.info("Annotating prompt %d/%d", step_counter, len(steps))
+                in_flight.append(
+                    (step, executor.submit(self.agent, usage=usage, **request(*step)))
+                )
+
+            while in_flight:
+                done, future = in_flight.popleft()
+                yield done, future.result()
+
+        used = usage.snapshot()
+        logging.info(
+            "Annotation used %d prompt tokens, %d of them cached (%.1f%%), "
+            "and %d completion tokens in %d requests",
+            used["prompt_tokens"],
+            used["cached_tokens"],
+            100 * used["cached_tokens"] / max(used["prompt_tokens"], 1),
+            used["completion_tokens"],
+            used["requests"],
+        )
+
+    def write_train_set(
+        self,
+        path: str,
+        prompt: Literal["cs", "mkt"] = "cs",
+        concurrency: int = ANNOTATION_CONCURRENCY,
+        **kwargs: Any,
+    ) -> None:
+        """
+        Method to write a fine-tuning set line by line, resuming after the
+        lines already written by an interrupted run with the same arguments
+        """
+        # drop a line cut short by the interruption
+        done = resume_jsonl(path)
+        if done:
+            logging.info("Resuming %s after %d prompts", path, done)
+
+        get_prompt = self.get_cs_prompt if prompt == "cs" else self.get_mkt_prompt
+        with JsonlWriter(path, append=True) as writer:
+            for *_, line in get_prompt(
+                train_test="train", concurrency=concurrency, skip=done, **kwargs
+            ):
+                writer.write(line)
+                writer.flush()
+
     def _get_train_yw(
         self,
         start_date: str = "2023-06-01",
         end_date: str = "2024-01-01",
     ) -> list:
         """
-        Get the training year and week
+        Get the training year and week, computed once per period
         """
-        return sorted(
-            [
-                (k[:4], k[4:])
-                for k, _ in dl.get_cs_data(
-                    start_date=start_date, end_date=end_date
-                ).items()
-            ]
-        )
+        if (start_date, end_date) not in self.train_yw:
+            self.train_yw[start_date, end_date] = sorted(
+                [
+                    (k[:4], k[4:])
+                    for k, _ in self.data_loader.get_cs_data(
+                        start_date=start_date, end_date=end_date
+                    ).items()
+                ]
+            )
+
+        return self.train_yw[start_date, end_date]
 
     def get_opt_prompt(self) -> Generator:
         """
         Generate the portfolio optimization prompt
         """
 
-        env_data = dl.get_env_data()
-        for yw_idx, cs_prompt_yw in enumerate(self.data_loader.get_cs_prompt()):
+        env_data = self.data_loader.get_env_data()[
+            ["time", "year", "week", "name", "daily_ret"]
+        ]
+        env_weeks = env_data.groupby(["year", "week"], sort=False).indices
+        train_yw = self._get_train_yw()
+
+        for (year, week), cs_prompt_yw in zip(
+            train_yw, self.data_loader.get_cs_prompt()
+        ):
 
             info = []
             long = []
             short = []
-            df_ret = pd.DataFrame()
-            year, week = self._get_train_yw()[yw_idx]
+            picks = []
 
             for cs_prompt in cs_prompt_yw:
                 crypto_name = cs_prompt["messages"][1]["content"].split("of ")[1].split(" to")[0]
@@ -121,19 +203,28 @@ class PromptGenerator:
                     case "Very High":
                         long.append(crypto_name)
                         info.append(strength_explanation)
-                        df_port = env_data.query("year == @year & week == \
-@week & name == @crypto_name").copy()
-                        df_port = df_port[["time", "year", "week", "name", "daily_ret"]]
-                        df_ret = pd.concat([df_ret, df_port])
+                        picks.append((crypto_name, 1))
 
                     case "Very Low":
                         short.append(crypto_name)
                         info.append(strength_explanation)
-                        df_port = env_data.query("year == @year & week == \
-@week & name == @crypto_name").copy()
-                        df_port["daily_ret"] = -df_port["daily_ret"]
-                        df_port = df_port[["time", "year", "week", "name", "daily_ret"]]
-                        df_ret = pd.concat([df_ret, df_port])
+                        picks.append((crypto_name, -1))
+
+            # Join the daily returns of the picks in the week, shorts negated
+            df_ret = pd.DataFrame()
+            if picks:
+                df_ret = (
+                    pd.DataFrame(picks, columns=["name", "sign"])
+                    .merge(
+                        env_data.iloc[env_weeks.get((year, week), [])].reset_index(),
+                        on="name",
+                        how="inner",
+                    )
+                    .set_index("index")
+                    .rename_axis(None)
+                )
+                df_ret["daily_ret"] = df_ret["daily_ret"] * df_ret["sign"]
+                df_ret = df_ret[["time", "year", "week", "name", "daily_ret"]]
 
             yield year, week, long, short, df_ret
 
@@ -146,9 +237,15 @@ class PromptGenerator:
         train_test: Literal["train", "test"] = "train",
         target: Literal["return strength", "price trend"] = "price trend",
         categories: Literal["Very High, High, Medium, Low, Very Low", "Rise or Fall"] = "Rise or Fall",
+        concurrency: int = 1,
+        skip: int = 0,
+        prefix_cache: bool = False,
     ) -> Generator:
         """
-        Generate cross-sectional prompt
+        Generate cross-sectional prompt, annotating the training prompts with
+        at most concurrency agent requests in flight and skipping the first
+        skip prompts. With prefix_cache, the annotation prompts start with the
+        knowledge so that their prefix is cached by the provider.
         """
         match data_type:
             case "factor":
@@ -156,6 +253,7 @@ class PromptGenerator:
                 pmt_instruc_map = {
                     "annot_instruc": AGENT_ANNOTATION_INSTRUCTION,
                     "annot_pmt": CROSS_SECTIONAL_ANNOTATION_PROMPT,
+                    "annot_cached_pmt": CROSS_SECTIONAL_CACHED_ANNOTATION_PROMPT,
                     "cs_instruc": CROSS_SECTIONAL_INSTRUCTION,
                     "cs_pmt": CROSS_SECTIONAL_PROMPT,
                     "paper": self.data_loader.get_literature_data("crypto_factors")
@@ -165,6 +263,7 @@ class PromptGenerator:
                 pmt_instruc_map = {
                     "annot_instruc": AGENT_ANNOTATION_INSTRUCTION,
                     "annot_pmt": VISION_ANNOTATION_PROMPT,
+                    "annot_cached_pmt": VISION_CACHED_ANNOTATION_PROMPT,
                     "cs_instruc": VISION_INSTRUCTION,
                     "cs_pmt": VISION_PROMPT,
                     "paper": self.data_loader.get_literature_data("candlestick")
@@ -188,91 +287,77 @@ class PromptGenerator:
                 pmt_instruc_map = {
                     "annot_instruc": AGENT_ANNOTATION_INSTRUCTION,
                     "annot_pmt": CROSS_SECTIONAL_PLUS_VISION_ANNOTATION_PROMPT,
+                    "annot_cached_pmt": CROSS_SECTIONAL_PLUS_VISION_CACHED_ANNOTATION_PROMPT,
                     "cs_instruc": CROSS_SECTIONAL_PLUS_VISION_INSTRUCTION,
                     "cs_pmt": CROSS_SECTIONAL_PLUS_VISION_PROMPT,
                     "paper": (self.data_loader.get_literature_data("crypto_factors") 
                               + self.data_loader.get_literature_data("candlestick"))
                 }
 
-        for yw_counter, (yw, data) in enumerate(cs_data.items(), 1):
-            for crypto_counter, (crypto, trend) in enumerate(data["trend"].items(), 1):
-                info = "".join(
+        steps = [
+            (
+                yw,
+                crypto,
+                trend,
+                "".join(
                     [
                         data[s][crypto] for s in strategy
                     ]
-                ) if isinstance(strategy, list) else data[strategy][crypto]
-
-                if train_test == "train":
-
-                    logging.info(
-                        "Processing crypto %s, item %d/%d in this week, week %d/%d",
-                        crypto,
-                        crypto_counter,
-                        len(data["trend"]),
-                        yw_counter,
-                        len(cs_data),
-                    )
-
-                    anno_prompt = pmt_instruc_map["annot_pmt"].format(
-                        crypto=crypto,
-                        info=info,
-                        trend=trend,
-                        num=CROSS_SECTIONAL_CRYPTO_NUMBER,
-                        target=target,
-                        Target=target.capitalize(),
-                        categories=categories,
-                        knowledge=pmt_instruc_map["paper"]
-                    )
-
-                    explanation = self.agent(
-                        prompt=anno_prompt,
-                        instruction=pmt_instruc_map["annot_instruc"].format(
-                            target = target
-                        ),
-                        vision_url=data["image_url"][crypto] if (
-                            (data_type == "vision")
-                            | (data_type == "both")
-                        ) else None,
-                    )
+                ) if isinstance(strategy, list) else data[strategy][crypto],
+                data["image_url"][crypto] if (
+                    (data_type == "vision")
+                    | (data_type == "both")
+                ) else None,
+            )
+            for yw, data in cs_data.items()
+            for crypto, trend in data["trend"].items()
+        ]
 
-                    ft_prompt = self._generate_ft_prompt(
-                        system_instruction=pmt_instruc_map["cs_instruc"].format(
-                            target = target,
-                            Target = target.capitalize()
-                        ),
-                        user_prompt=pmt_instruc_map["cs_pmt"].format(
-                            crypto=crypto,
-                            info=info,
-                            target=target,
-                            categories=categories
-                        ),
-                        assistant_content=ANSWER.format(
-                            trend=trend, explanation=explanation, Target=target.capitalize()
-                        ),
-                        vision_url=data["image_url"][crypto] if (
-                            (data_type == "vision")
-                            | (data_type == "both")
-                        ) else None, 
-                    )
-                else:
-                    ft_prompt = self._generate_ft_prompt(
-                        system_instruction=pmt_instruc_map["cs_instruc"].format(
-                            target=target,
-                            Target=target.capitalize()
-                        ),
-                        user_prompt=pmt_instruc_map["cs_pmt"].format(
-                            crypto=crypto,
-                            info=info,
-                            target=target,
-                            categories=categories
-                        ),
-                        assistant_content=trend,
-                        vision_url=data["image_url"][crypto] if (
-                            (data_type == "vision")
-                            | (data_type == "both")
-                        ) else None,
-                    )
-                yield (yw, crypto, {"messages": ft_prompt})
+        # Render the parts shared by all the prompts once
+        cs_instruc = pmt_instruc_map["cs_instruc"].format(
+            target=target,
+            Target=target.capitalize()
+        )
+        cs_pmt = Template(pmt_instruc_map["cs_pmt"]).partial(
+            target=target,
+            categories=categories
+        )
+        answer = Template(ANSWER).partial(Target=target.capitalize())
+
+        if train_test == "train":
+            annot_instruc = pmt_instruc_map["annot_instruc"].format(target=target)
+            annot_pmt = Template(
+                pmt_instruc_map["annot_cached_pmt" if prefix_cache else "annot_pmt"]
+            ).partial(
+                num=CROSS_SECTIONAL_CRYPTO_NUMBER,
+                target=target,
+                Target=target.capitalize(),
+                categories=categories,
+                knowledge=pmt_instruc_map["paper"]
+            )
+            annotated = self._annotate(
+                steps,
+                lambda yw, crypto, trend, info, vision_url: {
+                    "prompt": annot_pmt(crypto=crypto, info=info, trend=trend),
+                    "instruction": annot_instruc,
+                    "vision_url": vision_url,
+                },
+                concurrency=concurrency,
+                skip=skip,
+            )
+        else:
+            annotated = ((step, None) for step in steps[skip:])
+
+        for (yw, crypto, trend, info, vision_url), explanation in annotated:
+            ft_prompt = self._generate_ft_prompt(
+                system_instruction=cs_instruc,
+                user_prompt=cs_pmt(crypto=crypto, info=info),
+                assistant_content=answer(
+                    trend=trend, explanation=explanation
+                ) if train_test == "train" else trend,
+                vision_url=vision_url,
+            )
+            yield (yw, crypto, {"messages": ft_prompt})
 
     def get_mkt_prompt(
         self,
@@ -282,10 +367,16 @@ class PromptGenerator:
         strategy: list[str] | str = ["attn", "net"],
         train_test: Literal["train", "test"] = "train",
         target: Literal["market return", "market trend"] = "market trend",
-        categories: Literal["Very High, High, Medium, Low, Very Low", "Rise or Fall"] = "Rise or Fall"
+        categories: Literal["Very High, High, Medium, Low, Very Low", "Rise or Fall"] = "Rise or Fall",
+        concurrency: int = 1,
+        skip: int = 0,
+        prefix_cache: bool = False,
     ) -> Generator:
         """
-        Generate cross-sectional prompt
+        Generate market prompt, annotating the training prompts with at most
+        concurrency agent requests in flight and skipping the first skip
+        prompts. With prefix_cache, the annotation prompts start with the
+        knowledge so that their prefix is cached by the provider.
         """
 
         match data_type:
@@ -293,6 +384,7 @@ class PromptGenerator:
                 pmt_instruc_map = {
                     "annot_instruc": AGENT_ANNOTATION_INSTRUCTION,
                     "annot_pmt": MARKET_ANNOTATION_PROMPT,
+                    "annot_cached_pmt": MARKET_CACHED_ANNOTATION_PROMPT,
                     "mkt_instruc": MARKET_INSTRUCTION,
                     "mkt_pmt": MARKET_PROMPT,
                     "paper": self.data_loader.get_literature_data("market_factors")
@@ -301,6 +393,7 @@ class PromptGenerator:
                 pmt_instruc_map = {
                     "annot_instruc": AGENT_ANNOTATION_INSTRUCTION,
                     "annot_pmt": NEWS_ANNOTATION_PROMPT,
+                    "annot_cached_pmt": NEWS_CACHED_ANNOTATION_PROMPT,
                     "mkt_instruc": NEWS_INSTRUCTION,
                     "mkt_pmt": NEWS_PROMPT,
                     "paper": self.data_loader.get_literature_data("news")
@@ -309,6 +402,7 @@ class PromptGenerator:
                 pmt_instruc_map = {
                     "annot_instruc": AGENT_ANNOTATION_INSTRUCTION,
                     "annot_pmt": MARKET_PLUS_NEWS_ANNOTATION_PROMPT,
+                    "annot_cached_pmt": MARKET_PLUS_NEWS_CACHED_ANNOTATION_PROMPT,
                     "mkt_instruc": MARKET_PLUS_NEWS_INSTRUCTION,
                     "mkt_pmt": MARKET_PLUS_NEWS_PROMPT,
                     "paper": (self.data_loader.get_literature_data("market_factors") 
@@ -319,61 +413,60 @@ class PromptGenerator:
             start_date=start_date, end_date=end_date
         )
 
-        for yw_counter, (yw, data) in enumerate(mkt_data.items(), 1):
-            info = "".join(
-                [
-                        data[strategy] for strategy in strategy
-                ]
-            ) if isinstance(strategy, list) else data[strategy]
-
-            if train_test == "train":
-
-                logging.info(
-                    "Processing week %d/%d",
-                    yw_counter,
-                    len(mkt_data),
-                )
-                anno_prompt = pmt_instruc_map["annot_pmt"].format(
-                    info=info,
-                    trend=data["trend"],
-                    target=target,
-                    Target=target.capitalize(),
-                    categories=categories,
-                    knowledge=pmt_instruc_map["paper"]
-                )
-                explanation = self.agent(
-                    prompt=anno_prompt, instruction=pmt_instruc_map["annot_instruc"].format(
-                        target=target
-                    )
-                )
+        steps = [
+            (
+                yw,
+                data["trend"],
+                "".join(
+                    [
+                            data[strategy] for strategy in strategy
+                    ]
+                ) if isinstance(strategy, list) else data[strategy],
+            )
+            for yw, data in mkt_data.items()
+        ]
 
-                ft_prompt = self._generate_ft_prompt(
-                    system_instruction=pmt_instruc_map["mkt_instruc"].format(
-                        target = target,
-                        Target = target.capitalize()
-                    ),
-                    user_prompt=pmt_instruc_map["mkt_pmt"].format(
-                        info=info,
-                        target=target,
-                        categories=categories
-                    ),
-                    assistant_content=ANSWER.format(
-                        trend=data["trend"], explanation=explanation, Target=target.capitalize()
-                    ),
-                )
-            else:
-                ft_prompt = self._generate_ft_prompt(
-                    system_instruction=pmt_instruc_map["mkt_instruc"].format(
-                        target=target,
-                        Target=target.capitalize()
-                    ),
-                    user_prompt=pmt_instruc_map["mkt_pmt"].format(
-                        info=info,
-                        target=target,
-                        categories=categories
-                    ),
-                    assistant_content=data["trend"],
-                )
+        # Render the parts shared by all the prompts once
+        mkt_instruc = pmt_instruc_map["mkt_instruc"].format(
+            target=target,
+            Target=target.capitalize()
+        )
+        mkt_pmt = Template(pmt_instruc_map["mkt_pmt"]).partial(
+            target=target,
+            categories=categories
+        )
+        answer = Template(ANSWER).partial(Target=target.capitalize())
+
+        if train_test == "train":
+            annot_instruc = pmt_instruc_map["annot_instruc"].format(target=target)
+            annot_pmt = Template(
+                pmt_instruc_map["annot_cached_pmt" if prefix_cache else "annot_pmt"]
+            ).partial(
+                target=target,
+                Target=target.capitalize(),
+                categories=categories,
+                knowledge=pmt_instruc_map["paper"]
+            )
+            annotated = self._annotate(
+                steps,
+                lambda yw, trend, info: {
+                    "prompt": annot_pmt(info=info, trend=trend),
+                    "instruction": annot_instruc,
+                },
+                concurrency=concurrency,
+                skip=skip,
+            )
+        else:
+            annotated = ((step, None) for step in steps[skip:])
+
+        for (yw, trend, info), explanation in annotated:
+            ft_prompt = self._generate_ft_prompt(
+                system_instruction=mkt_instruc,
+                user_prompt=mkt_pmt(info=info),
+                assistant_content=answer(
+                    trend=trend, explanation=explanation
+                ) if train_test == "train" else trend,
+            )
 
             yield (yw, {"messages": ft_prompt})
 
@@ -2,93 +2,120 @@
 Prompts
 """
 
-# Annotation prompts
-CROSS_SECTIONAL_ANNOTATION_PROMPT = """Learn the following cryptocurrency investment \
-knowledge. Using this knowledge, explain the predicted {target} of {crypto} for the \
-upcoming week based on the provided information. The data for the top {num} cryptocurrencies, \
-including {crypto}, have been categorized into Very High, High, Medium, Low, and Very Low. \
-Their respective predicted {target} has been categorized into {categories}.
-
-Investment knowledge: {knowledge}
-(End of knowledge)
-
-Information: {info}
-(End of information)
-
-{Target}: {trend}
-(End of {target})"""
+# Parts of the annotation prompts
+ANNOTATION_INTRO = "Learn the following cryptocurrency investment knowledge."
 
-MARKET_ANNOTATION_PROMPT = """Learn the following cryptocurrency investment \
-knowledge. Using this knowledge, explain the predicted {target} for the upcoming \
-week based on the provided information. The market information data have been \
-categorized into Very High, High, Medium, Low, and Very Low using first \
-two years of data. The predicted market return has been categorized into {categories}.
-
-Investment knowledge: {knowledge}
-(End of knowledge)
-
-Information: {info}
-(End of information)
-
-{Target}: {trend}
-(End of {target})"""
+ANNOTATION_KNOWLEDGE = """Investment knowledge: {knowledge}
+(End of knowledge)"""
 
-NEWS_ANNOTATION_PROMPT = """Learn the following cryptocurrency investment \
-knowledge. Using this knowledge, explain the predicted {target} for the upcoming \
-week based on the provided news headlines. The predicted market return has been \
-categorized into {categories}.
-
-Investment knowledge: {knowledge}
-(End of knowledge)
-
-Information: {info}
-(End of information)
+ANNOTATION_INFO = """Information: {info}
+(End of information)"""
 
-{Target}: {trend}
+ANNOTATION_TREND = """{Target}: {trend}
 (End of {target})"""
 
-VISION_ANNOTATION_PROMPT = """Learn the following cryptocurrency investment \
-knowledge. Using this knowledge, explain the predicted {target} of {crypto} \
-for the upcoming week based on the provided candlestick chart. The chart \
-includes candlestick that depict daily opening, high, low, and closing \
-prices. It then overlays a 30-day moving average closing price. The \
-bottom of the chart shows daily trading volume.
+CROSS_SECTIONAL_ANNOTATION_TASK = """Using this knowledge, explain the predicted \
+{target} of {crypto} for the upcoming week based on the provided information. The data \
+for the top {num} cryptocurrencies, including {crypto}, have been categorized into Very \
+High, High, Medium, Low, and Very Low. Their respective predicted {target} has been \
+categorized into {categories}."""
 
-Investment knowledge: {knowledge}
-(End of knowledge)
+MARKET_ANNOTATION_TASK = """Using this knowledge, explain the predicted {target} for \
+the upcoming week based on the provided information. The market information data have \
+been categorized into Very High, High, Medium, Low, and Very Low using first two years \
+of data. The predicted market return has been categorized into {categories}."""
 
-{Target}: {trend}
-(End of {target})"""
+NEWS_ANNOTATION_TASK = """Using this knowledge, explain the predicted {target} for the \
+upcoming week based on the provided news headlines. The predicted market return has \
+been categorized into {categories}."""
 
-CROSS_SECTIONAL_PLUS_VISION_ANNOTATION_PROMPT = """Learn the following cryptocurrency investment \
-knowledge. Using this knowledge, explain the predicted {target} of {crypto} for the \
-upcoming week based on the provided indicators and candlestick chart. The data for the top {num} cryptocurrencies, \
-including {crypto}, have been categorized into Very High, High, Medium, Low, and Very Low. \
-Their respective predicted {target} has been categorized into {categories}.
+VISION_ANNOTATION_TASK = """Using this knowledge, explain the predicted {target} of \
+{crypto} for the upcoming week based on the provided candlestick chart. The chart \
+includes candlestick that depict daily opening, high, low, and closing prices. It then \
+overlays a 30-day moving average closing price. The bottom of the chart shows daily \
+trading volume."""
 
-Investment knowledge: {knowledge}
-(End of knowledge)
+CROSS_SECTIONAL_PLUS_VISION_ANNOTATION_TASK = """Using this knowledge, explain the \
+predicted {target} of {crypto} for the upcoming week based on the provided indicators \
+and candlestick chart. The data for the top {num} cryptocurrencies, including {crypto}, \
+have been categorized into Very High, High, Medium, Low, and Very Low. Their respective \
+predicted {target} has been categorized into {categories}."""
 
-Information: {info}
-(End of information)
+MARKET_PLUS_NEWS_ANNOTATION_TASK = """Using this knowledge, explain the predicted \
+{target} for the upcoming week based on the provided indicators and news headlines. The \
+market information data have been categorized into Very High, High, Medium, Low, and \
+Very Low using first two years of data. The predicted market return has been \
+categorized into {categories}."""
 
-{Target}: {trend}
-(End of {target})"""
 
-MARKET_PLUS_NEWS_ANNOTATION_PROMPT = """Learn the following cryptocurrency investment \
-knowledge. Using this knowledge, explain the predicted {target} for the upcoming \
-week based on the provided indicators and news headlines. The market information data have been \
-categorized into Very High, High, Medium, Low, and Very Low using first \
-two years of data. The predicted market return has been categorized into {categories}.
+def _annotation_prompt(task: str, *sections: str, knowledge_first: bool = False) -> str:
+    """
+    Function to join the parts of an annotation prompt, with the knowledge
+    after the task, or first so that every crypto and week shares the prompt
+    prefix the provider caches
+    """
+    if knowledge_first:
+        return "\n\n".join([ANNOTATION_INTRO, ANNOTATION_KNOWLEDGE, task, *sections])
 
-Investment knowledge: {knowledge}
-(End of knowledge)
+    return "\n\n".join([f"{ANNOTATION_INTRO} {task}", ANNOTATION_KNOWLEDGE, *sections])
 
-Information: {info}
-(End of information)
 
-{Target}: {trend}
-(End of {target})"""
+# Annotation prompts
+CROSS_SECTIONAL_ANNOTATION_PROMPT = _annotation_prompt(
+    CROSS_SECTIONAL_ANNOTATION_TASK, ANNOTATION_INFO, ANNOTATION_TREND
+)
+
+MARKET_ANNOTATION_PROMPT = _annotation_prompt(
+    MARKET_ANNOTATION_TASK, ANNOTATION_INFO, ANNOTATION_TREND
+)
+
+NEWS_ANNOTATION_PROMPT = _annotation_prompt(
+    NEWS_ANNOTATION_TASK, ANNOTATION_INFO, ANNOTATION_TREND
+)
+
+VISION_ANNOTATION_PROMPT = _annotation_prompt(VISION_ANNOTATION_TASK, ANNOTATION_TREND)
+
+CROSS_SECTIONAL_PLUS_VISION_ANNOTATION_PROMPT = _annotation_prompt(
+    CROSS_SECTIONAL_PLUS_VISION_ANNOTATION_TASK, ANNOTATION_INFO, ANNOTATION_TREND
+)
+
+MARKET_PLUS_NEWS_ANNOTATION_PROMPT = _annotation_prompt(
+    MARKET_PLUS_NEWS_ANNOTATION_TASK, ANNOTATION_INFO, ANNOTATION_TREND
+)
+
+# Annotation prompts with the knowledge first
+CROSS_SECTIONAL_CACHED_ANNOTATION_PROMPT = _annotation_prompt(
+    CROSS_SECTIONAL_ANNOTATION_TASK,
+    ANNOTATION_INFO,
+    ANNOTATION_TREND,
+    knowledge_first=True,
+)
+
+MARKET_CACHED_ANNOTATION_PROMPT = _annotation_prompt(
+    MARKET_ANNOTATION_TASK, ANNOTATION_INFO, ANNOTATION_TREND, knowledge_first=True
+)
+
+NEWS_CACHED_ANNOTATION_PROMPT = _annotation_prompt(
+    NEWS_ANNOTATION_TASK, ANNOTATION_INFO, ANNOTATION_TREND, knowledge_first=True
+)
+
+VISION_CACHED_ANNOTATION_PROMPT = _annotation_prompt(
+    VISION_ANNOTATION_TASK, ANNOTATION_TREND, knowledge_first=True
+)
+
+CROSS_SECTIONAL_PLUS_VISION_CACHED_ANNOTATION_PROMPT = _annotation_prompt(
+    CROSS_SECTIONAL_PLUS_VISION_ANNOTATION_TASK,
+    ANNOTATION_INFO,
+    ANNOTATION_TREND,
+    knowledge_first=True,
+)
+
+MARKET_PLUS_NEWS_CACHED_ANNOTATION_PROMPT = _annotation_prompt(
+    MARKET_PLUS_NEWS_ANNOTATION_TASK,
+    ANNOTATION_INFO,
+    ANNOTATION_TREND,
+    knowledge_first=True,
+)
 
 # Prediction prompts
 CROSS_SECTIONAL_PROMPT = """Analyze the following information of {crypto} to determine its \
@@ -0,0 +1,209 @@
+"""
+Client-side rate limiter for the OpenAI API
+"""
+
+import asyncio
+import json
+import re
+import threading
+import time
+from typing import Any, Mapping
+
+from environ.constants import (
+    OPENAI_COMPLETION_TOKENS,
+    OPENAI_IMAGE_TOKENS,
+    OPENAI_RPM,
+    OPENAI_TPM,
+)
+
+# Durations in the x-ratelimit-reset-* headers, e.g. "1s", "6m0s", "20ms"
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(duration: str | None) -> float | None:
+    """
+    Function to convert a rate limit reset duration into seconds
+    """
+    if not duration:
+        return None
+
+    matches = DURATION_PATTERN.findall(duration)
+    if not matches:
+        try:
+            return float(duration)
+        except ValueError:
+            return None
+
+    return sum(float(value) * DURATION_UNITS[unit] for value, unit in matches)
+
+
+def estimate_tokens(messages: list[dict[str, Any]]) -> int:
+    """
+    Function to estimate the tokens a request will consume
+    """
+    tokens = OPENAI_COMPLETION_TOKENS
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, list):
+            for part in content:
+                if part["type"] == "image_url":
+                    tokens += OPENAI_IMAGE_TOKENS
+                else:
+                    tokens += len(json.dumps(part)) // 4
+        else:
+            tokens += len(json.dumps(content)) // 4
+
+    return tokens
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously up to its capacity every minute
+    """
+
+    def __init__(self, capacity: float) -> None:
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        """
+        Method to add the tokens accrued since the last refill
+        """
+        self.level = min(
+            self.capacity, self.level + (now - self.updated) * self.capacity / 60
+        )
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Method to get the seconds until the amount is available
+        """
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limiter shared by all agents
+    """
+
+    def __init__(self, rpm: float = OPENAI_RPM, tpm: float = OPENAI_TPM) -> None:
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        """
+        Reserve a request and its tokens, or get the seconds to wait first
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+
+            wait = max(
+                self.paused_until - now,
+                self.requests.wait_time(1),
+                self.tokens.wait_time(tokens),
+            )
+            if wait <= 0:
+                self.requests.level -= 1
+                self.tokens.level -= tokens
+
+            return wait
+
+    def acquire(self, tokens: int) -> None:
+        """
+        Block until a request with the given tokens fits in the limits
+        """
+        while (wait := self._reserve(tokens)) > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int) -> None:
+        """
+        Wait without blocking the event loop until a request fits in the limits
+        """
+        while (wait := self._reserve(tokens)) > 0:
+            await asyncio.sleep(wait)
+
+    def update(self, headers: Mapping[str, str], estimated: int, used: int) -> None:
+        """
+        Self-tune the limits from the x-ratelimit-* headers of a response and
+        give back the tokens over-reserved by the estimate
+        """
+        with self._lock:
+            for bucket, kind in [(self.requests, "requests"), (self.tokens, "tokens")]:
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                if limit:
+                    bucket.capacity = float(limit)
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if remaining:
+                    bucket.level = min(bucket.level, float(remaining))
+
+            self.tokens.level = min(
+                self.tokens.capacity, self.tokens.level + estimated - used
+            )
+
+    @staticmethod
+    def _exhausted(headers: Mapping[str, str]) -> str | None:
+        """
+        Static method to get the limit a 429 ran out of, "requests" or
+        "tokens", from the one with the smallest share remaining
+        """
+        shares = {}
+        for kind in ["requests", "tokens"]:
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            if remaining and limit and float(limit) > 0:
+                shares[kind] = float(remaining) / float(limit)
+
+        return min(shares, key=shares.get) if shares else None
+
+    def backoff(self, headers: Mapping[str, str] | None = None) -> None:
+        """
+        Pause all requests after a 429 for the server's retry-after, or else
+        until the limit that ran out resets
+        """
+        headers = headers or {}
+        delay = parse_duration(headers.get("retry-after"))
+        if delay is None:
+            resets = {
+                kind: parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                for kind in ["requests", "tokens"]
+            }
+            exhausted = self._exhausted(headers)
+            if exhausted and resets[exhausted] is not None:
+                delay = resets[exhausted]
+            else:
+                # the sooner reset when it is unclear which limit ran out
+                delay = min(
+                    [reset for reset in resets.values() if reset is not None],
+                    default=None,
+                )
+
+        with self._lock:
+            # without a hint from the server, wait for a second of refill
+            self.paused_until = max(
+                self.paused_until, time.monotonic() + (delay or 1.0)
+            )
+
+
+# Rate limiter shared by all agents in the process
+_rate_limiter: RateLimiter | None = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Function to get the shared rate limiter
+    """
+    global _rate_limiter
+
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter()
+
+    return _rate_limiter
@@ -0,0 +1,100 @@
+"""
+Append-only JSONL log of the records of a run
+"""
+
+import argparse
+import json
+import os
+from typing import Any
+
+from environ.constants import RECORD_FSYNC_EVERY
+from environ.jsonl import JsonlWriter, drop_truncated_tail, read_jsonl
+
+
+class RecordStore:
+    """
+    Append-only JSONL record log with one line per (year-week, crypto) step
+    """
+
+    def __init__(self, path: str, fsync_every: int = RECORD_FSYNC_EVERY) -> None:
+        self.path = str(path)
+        self.fsync_every = fsync_every
+        self._unsynced = 0
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # cut a line left incomplete by a crash so new lines start on their own
+        drop_truncated_tail(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def append(self, yw: str, crypto: str, record: dict[str, Any]) -> None:
+        """
+        Method to log the record of a step
+        """
+        self._file.write(
+            json.dumps({"yw": yw, "crypto": crypto, "record": record}) + "\n"
+        )
+        self._file.flush()
+
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        """
+        Method to flush the logged records to disk
+        """
+        if self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def close(self) -> None:
+        """
+        Method to sync and close the log
+        """
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self) -> "RecordStore":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    @staticmethod
+    def load(path: str) -> dict[str, dict[str, Any]]:
+        """
+        Static method to rebuild the nested record dict from a log
+        """
+        records = {}
+        for step in read_jsonl(path):
+            records.setdefault(step["yw"], {})[step["crypto"]] = step["record"]
+
+        return records
+
+    @staticmethod
+    def compact(path: str, json_path: str | None = None) -> None:
+        """
+        Static method to rewrite a log with only the latest record of each
+        step, and optionally export it in the JSON record format
+        """
+        records = RecordStore.load(path)
+
+        with JsonlWriter(path, fsync=True) as writer:
+            for yw, info in records.items():
+                for crypto, record in info.items():
+                    writer.write({"yw": yw, "crypto": crypto, "record": record})
+
+        if json_path:
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(records, f, indent=4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact a JSONL record log")
+    parser.add_argument("path", help="JSONL record log")
+    parser.add_argument("json_path", nargs="?", help="JSON record to export")
+    args = parser.parse_args()
+
+    RecordStore.compact(args.path, args.json_path)
@@ -0,0 +1,156 @@
+"""
+Columnar storage of the processed datasets
+"""
+
+import logging
+import operator
+import os
+from pathlib import Path
+from typing import Any, Iterable
+
+import pandas as pd
+
+from environ.constants import AP_LABEL, PROCESSED_DATA_PATH
+
+# Processed datasets, stored as Parquet with the CSV kept only as an export
+DATASETS = {
+    "gecko_all": PROCESSED_DATA_PATH / "gecko_all",
+    "gecko_daily": PROCESSED_DATA_PATH / "signal" / "gecko_daily",
+    "weekly_features": PROCESSED_DATA_PATH / "signal" / "weekly_features",
+    "gecko_signal": PROCESSED_DATA_PATH / "signal" / "gecko_signal",
+    "gecko_daily_env": PROCESSED_DATA_PATH / "env" / "gecko_daily_env",
+    "gecko_mkt": PROCESSED_DATA_PATH / "signal" / "gecko_mkt",
+    "cmkt": PROCESSED_DATA_PATH / "market" / "cmkt",
+}
+
+TIME_COLUMNS = ["time", "date"]
+INT_COLUMNS = ["year", "week", "day"]
+
+FILTER_OPERATORS = {
+    "==": operator.eq,
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda col, value: col.isin(value),
+    "not in": lambda col, value: ~col.isin(value),
+}
+
+
+def dataset_path(name: str, suffix: str = ".parquet") -> Path:
+    """
+    Function to get the path of a dataset
+    """
+    return DATASETS[name].with_suffix(suffix)
+
+
+def stored_path(name: str) -> Path:
+    """
+    Function to get the file a dataset is read from, its Parquet if converted
+    """
+    path = dataset_path(name)
+    return path if path.exists() else dataset_path(name, ".csv")
+
+
+def typed(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Function to convert the columns of a dataset to their storage dtypes:
+    datetime times, integer year-weeks and categorical quintiles
+    """
+    df = df.copy()
+
+    for col in df.columns:
+        if col in TIME_COLUMNS:
+            df[col] = pd.to_datetime(df[col])
+        elif col in INT_COLUMNS:
+            # nullable integers keep the year-week keys free of ".0" with gaps
+            df[col] = df[col].astype("int64" if df[col].notna().all() else "Int64")
+        elif isinstance(df[col].dtype, pd.CategoricalDtype) or (
+            pd.api.types.is_object_dtype(df[col])
+            or pd.api.types.is_string_dtype(df[col])
+        ):
+            values = set(df[col].dropna().unique())
+            if values and values <= set(AP_LABEL):
+                df[col] = pd.Categorical(
+                    df[col].astype(object), categories=AP_LABEL, ordered=True
+                )
+
+    return df
+
+
+def write_dataset(df: pd.DataFrame, name: str, csv: bool = False) -> None:
+    """
+    Function to write a dataset as compressed Parquet, optionally exporting
+    it as CSV as well
+    """
+    path = dataset_path(name)
+    os.makedirs(path.parent, exist_ok=True)
+    typed(df).to_parquet(path, index=False, compression="zstd")
+
+    if csv:
+        export_csv(name)
+
+
+def filter_dataset(
+    df: pd.DataFrame, filters: Iterable[tuple[str, str, Any]]
+) -> pd.DataFrame:
+    """
+    Function to apply Parquet-style filters to a DataFrame
+    """
+    mask = pd.Series(True, index=df.index)
+    for col, op, value in filters:
+        mask &= FILTER_OPERATORS[op](df[col], value)
+
+    return df.loc[mask]
+
+
+def read_dataset(
+    name: str,
+    columns: list[str] | None = None,
+    filters: list[tuple[str, str, Any]] | None = None,
+) -> pd.DataFrame:
+    """
+    Function to read a dataset, projecting the columns and pushing the
+    filters down to the Parquet reader. Datasets not converted yet are
+    read from their CSV.
+    """
+    path = stored_path(name)
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path, columns=columns, filters=filters).reset_index(
+            drop=True
+        )
+
+    logging.info("No Parquet for %s, reading %s", name, path)
+    df = pd.read_csv(
+        path,
+        usecols=(
+            None
+            if columns is None
+            else list(dict.fromkeys(columns + [col for col, _, _ in filters or []]))
+        ),
+    )
+    df = typed(df)
+    if filters:
+        df = filter_dataset(df, filters).reset_index(drop=True)
+
+    return df if columns is None else df[columns]
+
+
+def export_csv(name: str, path: str | Path | None = None) -> None:
+    """
+    Function to export a dataset as CSV
+    """
+    read_dataset(name).to_csv(path or dataset_path(name, ".csv"), index=False)
+
+
+if __name__ == "__main__":
+    # convert the datasets still stored as CSV
+    for dataset in DATASETS:
+        if (
+            dataset_path(dataset, ".csv").exists()
+            and not dataset_path(dataset).exists()
+        ):
+            write_dataset(pd.read_csv(dataset_path(dataset, ".csv")), dataset)
+            logging.info("Converted %s to Parquet", dataset)
@@ -0,0 +1,78 @@
+"""
+Prompt templates parsed once and rendered in parts
+"""
+
+from string import Formatter
+from typing import Any
+
+_formatter = Formatter()
+
+
+class Template:
+    """
+    str.format template parsed into its literal text and fields, whose fixed
+    fields can be rendered ahead of the per-prompt ones
+    """
+
+    def __init__(self, template: str) -> None:
+        self.parts: list[tuple[str, str | None, str, str | None]] = []
+        for literal, field, spec, conversion in _formatter.parse(template):
+            self._append(literal)
+            if field is not None:
+                if not field or field.isdigit():
+                    raise ValueError(f"Positional field in template: {template!r}")
+                self.parts.append(("", field, spec or "", conversion))
+
+    def _append(self, literal: str) -> None:
+        """
+        Method to add literal text, merged into the previous literal part
+        """
+        if not literal:
+            return
+        if self.parts and self.parts[-1][1] is None:
+            self.parts[-1] = (self.parts[-1][0] + literal, None, "", None)
+        else:
+            self.parts.append((literal, None, "", None))
+
+    @staticmethod
+    def _render(field: str, spec: str, conversion: str | None, fields: dict) -> str:
+        """
+        Static method to render a field as str.format would
+        """
+        if field.isidentifier():
+            value = fields[field]
+        else:
+            value, _ = _formatter.get_field(field, (), fields)
+        if conversion:
+            value = _formatter.convert_field(value, conversion)
+
+        return format(value, spec)
+
+    def partial(self, **fields: Any) -> "Template":
+        """
+        Method to render the given fields once, keeping the others to render
+        per prompt
+        """
+        template = Template.__new__(Template)
+        template.parts = []
+        for literal, field, spec, conversion in self.parts:
+            if field is None:
+                template._append(literal)
+            elif field.split(".")[0].split("[")[0] in fields:
+                template._append(self._render(field, spec, conversion, fields))
+            else:
+                template.parts.append((literal, field, spec, conversion))
+
+        return template
+
+    def __call__(self, **fields: Any) -> str:
+        return "".join(
+            [
+                (
+                    literal
+                    if field is None
+                    else self._render(field, spec, conversion, fields)
+                )
+                for literal, field, spec, conversion in self.parts
+            ]
+        )
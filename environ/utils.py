@@ -4,20 +4,24 @@ Utility functions
 
 import pickle
 import warnings
+from functools import cache
 from typing import Iterable
 
 import numpy as np
 import pandas as pd
-from langchain_community.document_loaders.pdf import PyPDFLoader
-from sklearn.linear_model import LinearRegression
 
-from environ.constants import PROCESSED_DATA_PATH
+from environ.constants import AP_LABEL, PROCESSED_DATA_PATH
+from environ.storage import read_dataset
 
 warnings.filterwarnings("ignore")
 
-# excess market return
-er = pd.read_csv(f"{PROCESSED_DATA_PATH}/signal/gecko_mkt.csv")
-er["time"] = pd.to_datetime(er["time"])
+
+@cache
+def get_excess_returns() -> pd.DataFrame:
+    """
+    Function to get the excess market returns, read on first use
+    """
+    return read_dataset("gecko_mkt")
 
 
 def boom_bust_one_period(
@@ -256,35 +260,114 @@ def get_pdf_text(pdf_path: str) -> str:
     """
     Get text from a PDF file
     """
+    from langchain_community.document_loaders.pdf import PyPDFLoader
+
     pdf_loader = PyPDFLoader(file_path=pdf_path)
     return "".join([page.page_content for page in pdf_loader.load()])
 
 
-def cal_vol(key: tuple) -> tuple:
+def rolling_capm(
+    er: pd.DataFrame,
+    keys: pd.DataFrame,
+    window: int = 365,
+    min_obs: int = 60,
+) -> pd.DataFrame:
     """
-    Function to calculate the market related features
+    Function to calculate the market beta, idiosyncratic volatility and price
+    delay of each (id, time) key over the trailing window of days, from
+    running sums of cross-products of each id's excess returns
     """
-    idx, time = key
-    time_l365 = time - pd.offsets.Day(365)
-    tmp = er.loc[(er["id"] == idx) & er["time"].between(time_l365, time)].dropna()
+    er = er.dropna().sort_values(["id", "time"], ascending=True)
+    regressors = ["cmkt", "cmkt_l1", "cmkt_l2"]
+    res = np.full((len(keys), 3), np.nan)
+
+    key_rows = keys.groupby("id").indices
+    key_times = keys["time"].to_numpy(dtype="datetime64[ns]")
+    er_times = er["time"].to_numpy(dtype="datetime64[ns]")
+    er_values = np.column_stack(
+        [np.ones(len(er)), er[regressors].to_numpy(), er["eret"].to_numpy()]
+    )
+
+    for idx, rows in er.groupby("id").indices.items():
+        if idx not in key_rows:
+            continue
+
+        # running sums of [1, cmkt, cmkt_l1, cmkt_l2, eret] cross-products
+        z = er_values[rows]
+        cum = np.concatenate(
+            [np.zeros((1, 5, 5)), np.cumsum(z[:, :, None] * z[:, None, :], axis=0)]
+        )
+
+        # sums over the rows in [time - window, time]
+        times = er_times[rows]
+        out = key_rows[idx]
+        hi = np.searchsorted(times, key_times[out], side="right")
+        lo = np.searchsorted(
+            times, key_times[out] - np.timedelta64(window, "D"), side="left"
+        )
+        sums = cum[hi] - cum[lo]
 
-    if tmp.shape[0] <= 60:
-        return np.nan, np.nan, np.nan
+        n = sums[:, 0, 0]
+        valid = n > min_obs
+        out, sums, n = out[valid], sums[valid], n[valid]
 
-    X1 = tmp[["cmkt"]].values
-    X2 = tmp[["cmkt", "cmkt_l1", "cmkt_l2"]].values
-    Y = tmp["eret"].values
+        # centred cross-products of the regressors and the excess return
+        cross = sums[:, 1:, 1:] - sums[:, 1:, :1] * sums[:, :1, 1:] / n[:, None, None]
+        sxx, sxy, syy = cross[:, :3, :3], cross[:, :3, 3], cross[:, 3, 3]
+
+        # CAPM regression
+        beta = sxy[:, 0] / sxx[:, 0, 0]
+        ssr1 = syy - beta * sxy[:, 0]
+
+        # regression on the market return and its two lags
+        coef = np.einsum("kij,kj->ki", np.linalg.pinv(sxx), sxy)
+        ssr2 = syy - (coef * sxy).sum(axis=1)
+
+        res[out, 0] = beta
+        res[out, 1] = np.sqrt(np.maximum(ssr1, 0) / n)
+        res[out, 2] = (ssr1 - ssr2) / syy
+
+    return pd.DataFrame(
+        res, index=keys.index, columns=["vol_beta", "vol_idiovol", "vol_delay"]
+    )
+
+
+def rolling_quintiles(
+    time: pd.Series,
+    values: pd.Series,
+    window: pd.DateOffset | None = pd.DateOffset(years=2),
+    start: pd.Timestamp | None = None,
+) -> pd.Series:
+    """
+    Function to label each value with its quintile among the values of the
+    trailing window, or of all the past values if the window is None, as
+    pd.qcut on the window would. Values before the start are left unlabelled.
+    """
+    order = np.argsort(time.to_numpy(), kind="stable")
+    times = pd.Series(time.to_numpy()[order])
+    vals = values.to_numpy(dtype=float)[order]
+
+    # first row of the window of each row
+    lo = (
+        np.zeros(len(times), dtype=int)
+        if window is None
+        else np.searchsorted(times, times - window, side="left")
+    )
+    labelled = np.ones(len(times), dtype=bool) if start is None else times >= start
 
-    reg = LinearRegression().fit(X1, Y)
-    beta = reg.coef_[0]
-    idio = (Y - reg.predict(X1)).std()
-    r1 = reg.score(X1, Y)
+    labels = np.full(len(times), np.nan, dtype=object)
+    percentiles = np.linspace(0, 1, len(AP_LABEL) + 1) * 100
+    for i in np.flatnonzero(labelled):
+        edges = np.percentile(vals[lo[i] : i + 1], percentiles)
+        if np.unique(edges).size < edges.size:
+            raise ValueError(f"Quintile edges of {times[i]} must be unique: {edges}")
+        # right-closed bins, the lowest one including its left edge
+        labels[i] = AP_LABEL[np.searchsorted(edges[1:-1], vals[i], side="left")]
 
-    reg = LinearRegression().fit(X2, Y)
-    r2 = reg.score(X2, Y)
-    delay = r2 - r1
+    result = np.empty(len(times), dtype=object)
+    result[order] = labels
 
-    return beta, idio, delay
+    return pd.Series(result, index=values.index, name=values.name)
 
 
 def load_attn(path: str) -> pd.DataFrame:
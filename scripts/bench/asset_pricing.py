@@ -0,0 +1,77 @@
+"""
+Script to benchmark the quintile assignment of the asset pricing
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from environ.constants import AP_LABEL
+from environ.env_portfolio import Portfolio
+
+
+def legacy_asset_pricing(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Function to implement the asset pricing with the per-week loop
+    """
+
+    dfq = pd.DataFrame()
+    df.sort_values(["year", "week"], ascending=True, inplace=True)
+    for idx, dfyw in df.groupby(["year", "week"]):
+        dfyw = dfyw.sort_values("lin_prob", ascending=True)
+        dfyw.reset_index(drop=True, inplace=True)
+        n = dfyw.shape[0] // len(AP_LABEL)
+        for i, q in enumerate(AP_LABEL):
+            df_label = dfyw.iloc[i * n : (i + 1) * n].copy()
+            df_label["quitiles"] = q
+            df_label["year"] = idx[0]
+            df_label["week"] = idx[1]
+            dfq = pd.concat([dfq, df_label])
+
+    dfq["prob_ret"] = dfq["daily_ret"] * dfq["lin_prob"]
+    df_port = (
+        dfq.groupby(["time", "quitiles"])
+        .agg({"lin_prob": "sum", "prob_ret": "sum"})
+        .reset_index()
+    )
+    df_port["daily_ret"] = df_port["prob_ret"] / df_port["lin_prob"]
+
+    return df_port.pivot(
+        index="time", columns="quitiles", values="daily_ret"
+    ).reset_index()
+
+
+# synthetic panel of 5 years x 100 coins of daily returns, with a distinct
+# probability per row so that both methods agree on the quintiles
+rng = np.random.default_rng(0)
+days = pd.date_range("2020-01-06", periods=5 * 52 * 7, freq="D")
+df = pd.DataFrame(
+    {
+        "time": np.repeat(days, 100),
+        "name": np.tile([f"coin_{i}" for i in range(100)], len(days)),
+        "daily_ret": rng.normal(0, 0.05, len(days) * 100),
+        "lin_prob": rng.uniform(0, 1, len(days) * 100),
+    }
+)
+df["year"] = df["time"].dt.isocalendar().year.astype(str)
+df["week"] = df["time"].dt.isocalendar().week.astype(str)
+
+start = time.perf_counter()
+legacy = legacy_asset_pricing(df.copy())
+legacy_time = time.perf_counter() - start
+
+portfolio = Portfolio.__new__(Portfolio)
+portfolio.cmkt = portfolio.btc = portfolio.eth = portfolio.n = pd.DataFrame(
+    {"time": days}
+)
+start = time.perf_counter()
+vectorised = portfolio._asset_pricing(df.copy(), pd.DataFrame())
+vectorised_time = time.perf_counter() - start
+
+pd.testing.assert_frame_equal(
+    legacy, vectorised.drop(columns=["Long", "HML"]), check_names=False
+)
+print(f"Rows: {len(df)}")
+print(f"Loop: {legacy_time:.2f}s | Vectorised: {vectorised_time:.2f}s")
+print(f"Speedup: {legacy_time / vectorised_time:.1f}x")
@@ -0,0 +1,51 @@
+"""
+Script to benchmark the import time of the environment
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+
+# Lines of python -X importtime: "import time: self [us] | cumulative | name"
+IMPORT_TIME_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def import_time(module: str) -> list[tuple[int, int, str]]:
+    """
+    Function to import a module in a fresh interpreter and get the
+    cumulative import time (us), nesting level and name of each module
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    return [
+        (int(cumulative), len(indent) // 2, name)
+        for _, cumulative, indent, name in IMPORT_TIME_PATTERN.findall(result.stderr)
+    ]
+
+
+parser = argparse.ArgumentParser(description="Benchmark the import time")
+parser.add_argument("--module", default="environ.env", help="module to import")
+parser.add_argument("--runs", type=int, default=5, help="number of fresh imports")
+parser.add_argument("--top", type=int, default=15, help="slowest imports to show")
+parser.add_argument("--budget", type=float, help="maximum import time (ms)")
+args = parser.parse_args()
+
+runs = [import_time(args.module) for _ in range(args.runs)]
+total = min(
+    next(cumulative for cumulative, _, name in reversed(run) if name == args.module)
+    for run in runs
+)
+
+print(f"Slowest imports of {args.module} (cumulative ms):")
+for cumulative, level, name in sorted(runs[-1], reverse=True)[: args.top]:
+    print(f"{cumulative / 1000:10.1f}  {'  ' * level}{name}")
+print(f"Import time of {args.module}: {total / 1000:.1f}ms (best of {args.runs})")
+
+if args.budget is not None and total / 1000 > args.budget:
+    sys.exit(f"Import time over the {args.budget:.0f}ms budget")
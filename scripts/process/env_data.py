@@ -2,21 +2,14 @@
 Script to generate environment data
 """
 
-import os
-import pandas as pd
+from environ.storage import read_dataset, write_dataset
 
-from environ.constants import PROCESSED_DATA_PATH
+dfc = read_dataset("gecko_daily")
 
-os.makedirs(PROCESSED_DATA_PATH / "env", exist_ok=True)
-
-dfc = pd.read_csv(PROCESSED_DATA_PATH / "signal" / "gecko_daily.csv")
-
-dff = pd.read_csv(f"{PROCESSED_DATA_PATH}/signal/gecko_signal.csv").sort_values(
-    ["id", "time"], ascending=True
-)
+dff = read_dataset("gecko_signal").sort_values(["id", "time"], ascending=True)
 
 dfc = dfc.loc[dfc["id"].isin(dff["id"].unique())]
 # Year: 2023 Week: 22
 dfc = dfc.loc[dfc["time"] >= "2023-01-01"]
 
-dfc.to_csv(PROCESSED_DATA_PATH / "env" / "gecko_daily_env.csv", index=False)
+write_dataset(dfc, "gecko_daily_env")
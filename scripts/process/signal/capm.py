@@ -5,10 +5,10 @@ Script to perform feature engineering on the data
 import pandas as pd
 import numpy as np
 
-from environ.constants import PROCESSED_DATA_PATH
+from environ.storage import read_dataset, write_dataset
 from scripts.process.signal.rf import rf
 
-df = pd.read_csv(f"{PROCESSED_DATA_PATH}/gecko_all.csv")
+df = read_dataset("gecko_all")
 df.rename(columns={"date": "time"}, inplace=True)
 df["time"] = pd.to_datetime(df["time"])
 df.sort_values(["id", "time"], ascending=True, inplace=True)
@@ -54,4 +54,4 @@ df.sort_values(["id", "time"], ascending=True, inplace=True)
 df["eret"] = df["daily_ret"] - df["rf"]
 df = df.merge(mkt.reset_index(), on="time", how="left", validate="m:1")
 
-df.to_csv(PROCESSED_DATA_PATH / "signal" / "gecko_mkt.csv", index=False)
+write_dataset(df, "gecko_mkt")
@@ -2,15 +2,11 @@
 Script to generate the value-weighted index of the cryptocurrency market.
 """
 
-import os
-
 import pandas as pd
 
-from environ.constants import PROCESSED_DATA_PATH
-
-os.makedirs(f"{PROCESSED_DATA_PATH}/market", exist_ok=True)
+from environ.storage import read_dataset, write_dataset
 
-df = pd.read_csv(f"{PROCESSED_DATA_PATH}/gecko_all.csv")
+df = read_dataset("gecko_all")
 df.rename(columns={"date": "time"}, inplace=True)
 df = df[["id", "time", "prices", "market_caps", "total_volumes"]]
 df["time"] = pd.to_datetime(df["time"])
@@ -56,4 +52,4 @@ dfm.dropna(subset=["cmkt"], how="any", inplace=True)
 #     ]["tercile"].values[0]
 dfm["trend"] = dfm["cmkt"].apply(lambda x: "Rise" if x > 0 else "Fall")
 
-dfm.to_csv(f"{PROCESSED_DATA_PATH}/market/cmkt.csv", index=False)
+write_dataset(dfm, "cmkt")
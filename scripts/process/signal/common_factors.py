@@ -4,17 +4,12 @@ Script to perform feature engineering on the data
 
 import numpy as np
 import pandas as pd
-from pandarallel import pandarallel
 
-from environ.constants import (
-    CROSS_SECTIONAL_CRYPTO_NUMBER,
-    PROCESSED_DATA_PATH,
-)
-from environ.utils import cal_vol
-
-pandarallel.initialize(progress_bar=True, nb_workers=25)
+from environ.constants import CROSS_SECTIONAL_CRYPTO_NUMBER
+from environ.storage import read_dataset, write_dataset
+from environ.utils import get_excess_returns, rolling_capm
 
-df = pd.read_csv(f"{PROCESSED_DATA_PATH}/signal/gecko_daily.csv")
+df = read_dataset("gecko_daily")
 df["time"] = pd.to_datetime(df["time"])
 
 
@@ -105,10 +100,9 @@ df["vol_stdprcvol"] = df["std_volumes"]
 df["vol_damihud"] = df["avg_daily_ret"].map(abs) / df["avg_volumes"]
 
 # Beta
-df["key"] = df[["id", "time"]].values.tolist()
-df["result"] = df["key"].parallel_apply(cal_vol)
-df["vol_beta"], df["vol_idiovol"], df["vol_delay"] = zip(*list(df["result"].values))
+df[["vol_beta", "vol_idiovol", "vol_delay"]] = rolling_capm(
+    get_excess_returns(), df[["id", "time"]]
+)
 df["vol_beta2"] = df["vol_beta"] ** 2
-df.drop(columns=["key", "result"], inplace=True)
 
-df.to_csv(f"{PROCESSED_DATA_PATH}/signal/weekly_features.csv", index=False)
+write_dataset(df, "weekly_features")
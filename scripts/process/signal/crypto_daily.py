@@ -2,19 +2,13 @@
 Script to process the crypto data
 """
 
-import os
-
 import numpy as np
 import pandas as pd
 
-from environ.constants import PROCESSED_DATA_PATH
+from environ.storage import read_dataset, write_dataset
 from scripts.fetch.stablecoin import stablecoins
 
-os.makedirs(PROCESSED_DATA_PATH / "signal", exist_ok=True)
-
-df_crypto = pd.read_csv(
-    PROCESSED_DATA_PATH / "gecko_all.csv",
-)
+df_crypto = read_dataset("gecko_all")
 
 # minus the date by 1
 # df_crypto.rename(columns={"time": "date"}, inplace=True)
@@ -57,4 +51,4 @@ df_crypto["daily_ret"] = df_crypto.groupby("id")["daily_ret"].transform(
 )
 
 # save the daily data
-df_crypto.to_csv(PROCESSED_DATA_PATH / "signal" / "gecko_daily.csv", index=False)
+write_dataset(df_crypto, "gecko_daily")
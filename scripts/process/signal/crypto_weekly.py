@@ -4,9 +4,10 @@ Script to create a fine-tuning dataset from the original dataset.
 
 import pandas as pd
 
-from environ.constants import CROSS_SECTIONAL_CRYPTO_NUMBER, PROCESSED_DATA_PATH
+from environ.constants import CROSS_SECTIONAL_CRYPTO_NUMBER
+from environ.storage import read_dataset, write_dataset
 
-df_crypto = pd.read_csv(f"{PROCESSED_DATA_PATH}/signal/weekly_features.csv")
+df_crypto = read_dataset("weekly_features")
 df_crypto["time"] = pd.to_datetime(df_crypto["time"])
 
 # remove nan
@@ -62,4 +63,4 @@ for var in VAR_LIST:
 df_weekly["ret_signal"] = df_weekly["ret"].apply(lambda x: "Rise" if x > 0 else "Fall")
 # df_weekly["ret_signal"] = df_weekly["ret"]
 df_weekly.drop(columns=["daily_ret"], inplace=True)
-df_weekly.to_csv(f"{PROCESSED_DATA_PATH}/signal/gecko_signal.csv", index=False)
+write_dataset(df_weekly, "gecko_signal")
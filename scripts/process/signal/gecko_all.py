@@ -6,7 +6,7 @@ import pandas as pd
 from tqdm import tqdm
 import numpy as np
 
-from environ.constants import PROCESSED_DATA_PATH
+from environ.storage import write_dataset
 
 DATA_PATH = Path("/home/yichen/coingecko/data")
 
@@ -70,4 +70,4 @@ df_charts["prices"] = df_charts.groupby("id")["prices"].ffill()
 df_charts["market_caps"] = df_charts.groupby("id")["market_caps"].ffill()
 df_charts.dropna(subset=["prices", "market_caps"], inplace=True)
 
-df_charts.to_csv(PROCESSED_DATA_PATH / "gecko_all.csv", index=False)
+write_dataset(df_charts, "gecko_all")
@@ -8,10 +8,14 @@ import warnings
 import pandas as pd
 
 from environ.constants import DATA_PATH
-from environ.utils import load_attn
+from environ.utils import load_attn, rolling_quintiles
 
 warnings.filterwarnings("ignore")
 
+# Window of the past weeks each week's factors are ranked in, None to use
+# all the past weeks
+MARKET_FACTOR_WINDOW = pd.DateOffset(years=2)
+
 df = pd.DataFrame()
 
 # network factor from blockchain.io
@@ -91,38 +95,22 @@ df = pd.merge(df, df_attn_all, on=["year", "week"], how="inner")
 df = pd.merge(df, df_metrics, on=["year", "week"], how="inner")
 market_factors = df.dropna()
 
-df_full = market_factors.copy()
-
-for idx, row in df_full.loc[df_full["year"] >= 2022].iterrows():
-    year = row["year"]
-    week = row["week"]
-    current_date = df_full[(df_full["year"] == year) & (df_full["week"] == week)][
-        "time"
-    ].values[0]
-    df_sample = df_full[
-        (df_full["time"] <= current_date)
-        & (df_full["time"] >= current_date - pd.DateOffset(years=2))
-    ].copy()
-
-    for factor in [
-        "net_unique_addresses",
-        "attn_btc",
-        "attn_crypto",
-        "net_active_addresses",
-        "net_transactions",
-        "net_payments",
-    ]:
-        # cut the cmkt into terciles
-        df_sample[factor] = pd.qcut(
-            df_sample[factor],
-            5,
-            labels=["Very Low", "Low", "Medium", "High", "Very High"],
-        )
-
-        market_factors.loc[
-            (market_factors["year"] == year) & (market_factors["week"] == week),
-            factor,
-        ] = df_sample[df_sample["time"] == current_date][factor].values[0]
+# label each week with its quintile over the trailing window, from 2022 on
+start = market_factors.loc[market_factors["year"] >= 2022, "time"].min()
+for factor in [
+    "net_unique_addresses",
+    "attn_btc",
+    "attn_crypto",
+    "net_active_addresses",
+    "net_transactions",
+    "net_payments",
+]:
+    market_factors[factor] = rolling_quintiles(
+        market_factors["time"],
+        market_factors[factor],
+        window=MARKET_FACTOR_WINDOW,
+        start=start,
+    )
 
 # merge the cointelegraph data
 crypto_news = pd.read_csv(f"{DATA_PATH}/cointelegraph.csv")
@@ -2,130 +2,310 @@
 Script to process the OHLC data
 """
 
-import os
+import argparse
 import glob
+import hashlib
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.util import Finalize
+from typing import Any, Iterator, Literal
 
 import pandas as pd
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 from tqdm import tqdm
 
 from environ.constants import DATA_PATH, FIGURE_PATH, PROCESSED_DATA_PATH
+from environ.storage import read_dataset
 
 CANDLESTICKS_DAYS = 30
 
-os.makedirs(FIGURE_PATH / "ohlc", exist_ok=True)
+# Rendered charts, and the hash of the input window of each one kept with
+# the other build caches rather than next to the tracked charts
+OHLC_PATH = FIGURE_PATH / "ohlc"
+MANIFEST_PATH = PROCESSED_DATA_PATH / "cache" / "ohlc_manifest.json"
 
-env = pd.read_csv(PROCESSED_DATA_PATH / "env" / "gecko_daily_env.csv")
-env["time"] = pd.to_datetime(env["time"])
+# Columns a chart is drawn from
+CHART_COLUMNS = ["time", "open", "high", "low", "close", "ma", "total_volumes"]
 
-# load all data under DATA_PATH/cryptocompare
-df_olhc = pd.DataFrame()
+# Chart size in pixels before the 2x scale, and the candle colors of plotly
+CHART_WIDTH = 500
+CHART_HEIGHT = 400
+CHART_SCALE = 2
+INCREASING_COLOR = "#3D9970"
+DECREASING_COLOR = "#FF4136"
 
-for f in glob.glob(f"{DATA_PATH}/cryptocompare/*.json"):
-    with open(f, "r", encoding="utf-8") as file:
-        data = json.load(file)
-        olhc = pd.DataFrame(data["Data"]["Data"])
-        olhc["id"] = f.split("/")[-1].split(".")[0]
-        df_olhc = pd.concat([df_olhc, olhc])
+# Figure reused by the charts drawn in a worker with the Agg backend
+_agg_figure: Any = None
 
-df_olhc = df_olhc[["id", "time", "open", "low", "high", "close"]]
-df_olhc["time"] = pd.to_datetime(df_olhc["time"], unit="s")
 
-# merge the data
-df_olhc = pd.merge(df_olhc, env, on=["id", "time"], how="inner")
-yw_list = (
-    df_olhc.loc[
-        (df_olhc["time"] > "2024-08-25") & (df_olhc["time"] < "2026-03-01"),
-        ["year", "week"],
-    ]
-    .drop_duplicates()
-    .values.tolist()
-    .copy()
-)
-
-# calculae the moving average
-df_olhc.sort_values(["id", "time"], ascending=True, inplace=True)
-df_olhc["ma"] = df_olhc.groupby("id")["close"].transform(
-    lambda x: x.rolling(window=CANDLESTICKS_DAYS).mean()
-)
-
-for year, week in tqdm(yw_list):
-    eow = df_olhc.loc[
-        (df_olhc["year"] == year) & (df_olhc["week"] == week) & (df_olhc["day"] == 7),
-        "time",
-    ].values[0]
-
-    # get the month data
-    df_yw = df_olhc.loc[
-        (df_olhc["time"] > eow - pd.DateOffset(days=CANDLESTICKS_DAYS))
-        & (df_olhc["time"] <= eow),
-        :,
-    ].copy()
-
-    for id in df_yw["id"].unique():
-        df = df_yw.loc[df_yw["id"] == id, :].copy()
-        candlesticks = go.Candlestick(
-            x=df["time"],
-            open=df["open"],
-            high=df["high"],
-            low=df["low"],
-            close=df["close"],
-            showlegend=False,
-        )
-        volume_bars = go.Bar(
-            x=df["time"],
-            y=df["total_volumes"],
-            marker=dict(color="grey"),
-            showlegend=False,
-            width=12 * 60 * 60 * 1000,
-        )
-        ma = go.Scatter(
-            x=df["time"],
-            y=df["ma"],
-            mode="lines",
-            line=dict(color="black"),
-            showlegend=False,
-        )
+def load_ohlc() -> pd.DataFrame:
+    """
+    Function to load the daily OHLC data with the volumes and moving average
+    """
+    env = read_dataset("gecko_daily_env")
 
-        fig = go.Figure(candlesticks)
-        fig = make_subplots(
-            rows=2,
-            cols=1,
-            shared_xaxes=True,
-            vertical_spacing=0.1,
-            row_width=[0.2, 0.8],
-        )
-        fig.add_trace(candlesticks, row=1, col=1)
-        fig.add_trace(ma, row=1, col=1)
-        fig.add_trace(volume_bars, row=2, col=1)
-        fig.update_layout(
-            height=400,
-            width=500,
-            plot_bgcolor="white",  # Black background for plot
-            paper_bgcolor="white",  # Black background for the entire figure
-            # Hide Plotly scrolling minimap below the price chart
-            xaxis={"rangeslider": {"visible": False}},
-            margin=dict(l=20, r=20, t=20, b=20),
-        )
-        # fig.update_xaxes(showgrid=True, gridcolor="lightgrey", gridwidth=0.5)
-        fig.update_yaxes(
-            # showgrid=True,
-            # gridcolor="lightgrey",
-            # gridwidth=0.5,
-            # title="Price $",
-            row=1,
-            col=1,
-        )
-        fig.update_yaxes(
-            # showgrid=True,
-            # gridcolor="lightgrey",
-            # gridwidth=0.5,
-            # title="Volume $",
-            row=2,
-            col=1,
+    # load all data under DATA_PATH/cryptocompare
+    olhc_list = []
+    for f in glob.glob(f"{DATA_PATH}/cryptocompare/*.json"):
+        with open(f, "r", encoding="utf-8") as file:
+            data = json.load(file)
+            olhc = pd.DataFrame(data["Data"]["Data"])
+            olhc["id"] = f.split("/")[-1].split(".")[0]
+            olhc_list.append(olhc)
+
+    df_olhc = pd.concat(olhc_list)[["id", "time", "open", "low", "high", "close"]]
+    df_olhc["time"] = pd.to_datetime(df_olhc["time"], unit="s")
+
+    # merge the data
+    df_olhc = pd.merge(df_olhc, env, on=["id", "time"], how="inner")
+
+    # calculae the moving average
+    df_olhc.sort_values(["id", "time"], ascending=True, inplace=True)
+    df_olhc["ma"] = df_olhc.groupby("id")["close"].transform(
+        lambda x: x.rolling(window=CANDLESTICKS_DAYS).mean()
+    )
+
+    return df_olhc
+
+
+def chart_windows(df_olhc: pd.DataFrame) -> Iterator[tuple[str, pd.DataFrame]]:
+    """
+    Function to get the name and input window of each crypto-week chart
+    """
+    yw_list = (
+        df_olhc.loc[
+            (df_olhc["time"] > "2024-08-25") & (df_olhc["time"] < "2026-03-01"),
+            ["year", "week"],
+        ]
+        .drop_duplicates()
+        .values.tolist()
+    )
+
+    for year, week in yw_list:
+        eow = df_olhc.loc[
+            (df_olhc["year"] == year)
+            & (df_olhc["week"] == week)
+            & (df_olhc["day"] == 7),
+            "time",
+        ].values[0]
+
+        # get the month data
+        df_yw = df_olhc.loc[
+            (df_olhc["time"] > eow - pd.DateOffset(days=CANDLESTICKS_DAYS))
+            & (df_olhc["time"] <= eow),
+            ["id"] + CHART_COLUMNS,
+        ]
+
+        for id, df in df_yw.groupby("id", sort=False):
+            yield f"{id}_{year}_{week}.png", df[CHART_COLUMNS].reset_index(drop=True)
+
+
+def chart_hash(df: pd.DataFrame, backend: str) -> str:
+    """
+    Function to hash the input window and backend of a chart
+    """
+    digest = hashlib.sha256(backend.encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+
+    return digest.hexdigest()
+
+
+def render_plotly(df: pd.DataFrame, path: str) -> None:
+    """
+    Function to render a chart with plotly and kaleido
+    """
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    candlesticks = go.Candlestick(
+        x=df["time"],
+        open=df["open"],
+        high=df["high"],
+        low=df["low"],
+        close=df["close"],
+        showlegend=False,
+    )
+    volume_bars = go.Bar(
+        x=df["time"],
+        y=df["total_volumes"],
+        marker=dict(color="grey"),
+        showlegend=False,
+        width=12 * 60 * 60 * 1000,
+    )
+    ma = go.Scatter(
+        x=df["time"],
+        y=df["ma"],
+        mode="lines",
+        line=dict(color="black"),
+        showlegend=False,
+    )
+
+    fig = make_subplots(
+        rows=2,
+        cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.1,
+        row_width=[0.2, 0.8],
+    )
+    fig.add_trace(candlesticks, row=1, col=1)
+    fig.add_trace(ma, row=1, col=1)
+    fig.add_trace(volume_bars, row=2, col=1)
+    fig.update_layout(
+        height=CHART_HEIGHT,
+        width=CHART_WIDTH,
+        plot_bgcolor="white",
+        paper_bgcolor="white",
+        # Hide Plotly scrolling minimap below the price chart
+        xaxis={"rangeslider": {"visible": False}},
+        margin=dict(l=20, r=20, t=20, b=20),
+    )
+
+    fig.write_image(path, scale=CHART_SCALE)
+
+
+def init_worker(backend: Literal["plotly", "agg"]) -> None:
+    """
+    Function to start the renderer a worker reuses for all its charts
+    """
+    if backend != "plotly":
+        return
+
+    import kaleido
+
+    # kaleido>=1 starts a browser per image unless its sync server is running,
+    # while kaleido<1 keeps the chromium process of its scope on its own
+    if hasattr(kaleido, "start_sync_server"):
+        kaleido.start_sync_server(silence_warnings=True)
+        # pool workers skip atexit, but run the multiprocessing finalizers
+        Finalize(None, kaleido.stop_sync_server, exitpriority=10)
+
+
+def render_agg(df: pd.DataFrame, path: str) -> None:
+    """
+    Function to render a chart with matplotlib's Agg backend
+    """
+    global _agg_figure
+
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+    from matplotlib.dates import AutoDateLocator, DateFormatter
+
+    if _agg_figure is None:
+        _agg_figure = plt.figure(
+            figsize=(CHART_WIDTH / 100, CHART_HEIGHT / 100), dpi=100 * CHART_SCALE
         )
+    fig = _agg_figure
+    fig.clear()
+    price_ax, volume_ax = fig.subplots(
+        2, 1, sharex=True, gridspec_kw={"height_ratios": [0.8, 0.2], "hspace": 0.1}
+    )
+    fig.subplots_adjust(left=0.1, right=0.96, top=0.95, bottom=0.08)
+
+    colors = [
+        INCREASING_COLOR if close >= open else DECREASING_COLOR
+        for open, close in zip(df["open"], df["close"])
+    ]
+    price_ax.vlines(df["time"], df["low"], df["high"], colors=colors, linewidth=1)
+    price_ax.bar(
+        df["time"],
+        (df["close"] - df["open"]).abs(),
+        bottom=df[["open", "close"]].min(axis=1),
+        width=0.6,
+        color=colors,
+        alpha=0.5,
+        edgecolor=colors,
+        linewidth=1,
+    )
+    price_ax.plot(df["time"], df["ma"], color="black", linewidth=1.5)
+    volume_ax.bar(df["time"], df["total_volumes"], width=0.5, color="grey")
+
+    volume_ax.xaxis.set_major_locator(AutoDateLocator(maxticks=6))
+    volume_ax.xaxis.set_major_formatter(DateFormatter("%b %d"))
+    for ax in [price_ax, volume_ax]:
+        ax.set_facecolor("white")
+        ax.tick_params(labelsize=7)
+    fig.savefig(path, facecolor="white")
+
+
+def render_chart(backend: Literal["plotly", "agg"], name: str, df: pd.DataFrame) -> str:
+    """
+    Function to render a chart in a worker
+    """
+    {"plotly": render_plotly, "agg": render_agg}[backend](df, f"{OHLC_PATH}/{name}")
+
+    return name
+
+
+def load_manifest() -> dict[str, str]:
+    """
+    Function to load the hashes of the rendered charts
+    """
+    if not MANIFEST_PATH.exists():
+        return {}
+
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict[str, str]) -> None:
+    """
+    Function to save the hashes of the rendered charts
+    """
+    os.makedirs(MANIFEST_PATH.parent, exist_ok=True)
+    tmp_path = MANIFEST_PATH.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def render_charts(
+    backend: Literal["plotly", "agg"] = "plotly",
+    workers: int | None = None,
+    force: bool = False,
+) -> None:
+    """
+    Function to render the charts whose input window changed since they were
+    last rendered, across a process pool
+    """
+    os.makedirs(OHLC_PATH, exist_ok=True)
+    manifest = {} if force else load_manifest()
+
+    pending = {}
+    for name, df in chart_windows(load_ohlc()):
+        digest = chart_hash(df, backend)
+        if manifest.get(name) != digest or not (OHLC_PATH / name).exists():
+            pending[name] = (digest, df)
+    print(f"Rendering {len(pending)} charts, skipping the unchanged ones")
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker, initargs=(backend,)
+        ) as executor:
+            futures = [
+                executor.submit(render_chart, backend, name, df)
+                for name, (_, df) in pending.items()
+            ]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                name = future.result()
+                manifest[name] = pending[name][0]
+    finally:
+        save_manifest(manifest)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the OHLC charts")
+    parser.add_argument(
+        "--backend",
+        choices=["plotly", "agg"],
+        default="plotly",
+        help="plotly with kaleido, or the faster matplotlib Agg backend",
+    )
+    parser.add_argument("--workers", type=int, help="rendering processes")
+    parser.add_argument(
+        "--force", action="store_true", help="re-render the unchanged charts"
+    )
+    args = parser.parse_args()
 
-        # Save the figure
-        fig.write_image(f"{FIGURE_PATH}/ohlc/{id}_{year}_{week}.png", scale=2)
+    render_charts(args.backend, args.workers, args.force)
@@ -0,0 +1,231 @@
+"""
+Tests of the Batch API mode of the environment against the local stand-in
+"""
+
+import json
+import pickle
+
+import pytest
+
+import environ.agent
+import environ.env
+from environ.agent import FTAgent
+from environ.batch_server import BatchServer, completion_body
+from environ.env import Environment
+
+WEEKS = [("2024", "10"), ("2024", "11")]
+CRYPTOS = ["bitcoin", "ethereum", "solana"]
+
+
+class FakeDataHandler:
+    """
+    Test set of two weeks of three cryptos
+    """
+
+    def __init__(self) -> None:
+        self.cs_test_data = {
+            f"{year}{week}": {
+                crypto: {
+                    "messages": [
+                        {"role": "system", "content": "instruction"},
+                        {"role": "user", "content": f"{crypto} {year}{week}"},
+                        {"role": "assistant", "content": "Rise"},
+                    ]
+                }
+                for crypto in CRYPTOS
+            }
+            for year, week in WEEKS
+        }
+
+    def get_yw_list(self) -> list[tuple[str, str]]:
+        return WEEKS
+
+    def get_crypto_list(self, year: str, week: str) -> list[str]:
+        return list(self.cs_test_data[f"{year}{week}"])
+
+    def get_ret_state(self, year: str, week: str, crypto: str | None) -> str:
+        return f"ret {crypto} {year}{week}"
+
+
+class FakePortfolio:
+    """
+    Portfolio keeping the updates it receives
+    """
+
+    def __init__(self) -> None:
+        self.updates = []
+        self.priced = 0
+
+    def reset(self) -> None:
+        self.updates = []
+
+    def update(self, **kwargs) -> None:
+        self.updates.append(kwargs)
+
+    def asset_pricing(self, data_type: str) -> None:
+        self.priced += 1
+
+
+def responder(failing: set[str]):
+    """
+    Answer a Rise for bitcoin and a Fall otherwise, failing the given prompts
+    """
+
+    def respond(body: dict) -> dict:
+        prompt = body["messages"][-1]["content"]
+        if prompt in failing:
+            raise RuntimeError("request failed")
+        label = "Rise" if prompt.startswith("bitcoin") else "Fall"
+
+        return completion_body(
+            f"Price trend: {label}\nExplanation: stand-in",
+            ["Price", " trend", ":", f" {label}", "\n", "Explanation", ":", " x"],
+        )
+
+    return respond
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = BatchServer(responder({"solana 202411"}))
+    agent = FTAgent(model="stand-in")
+    monkeypatch.setitem(
+        environ.agent._clients,
+        (agent.max_connections, agent.timeout),
+        server.client(),
+    )
+    monkeypatch.setattr(environ.agent.time, "sleep", lambda seconds: None)
+
+    return server
+
+
+@pytest.fixture
+def make_env(monkeypatch, tmp_path):
+    monkeypatch.setattr(environ.env, "DataHandler", FakeDataHandler)
+    monkeypatch.setattr(environ.env, "get_portfolio", FakePortfolio)
+    agent_path = tmp_path / "cs.pkl"
+    with open(agent_path, "wb") as f:
+        pickle.dump(FTAgent(model="stand-in"), f)
+
+    return lambda: Environment(cs_agent_path=str(agent_path))
+
+
+def test_run_batch_then_replay(server, make_env, tmp_path):
+    record_path = tmp_path / "record_cs.json"
+    batch_path = tmp_path / "batch" / "cs.jsonl"
+
+    env = make_env()
+    env.run_batch("cs", str(record_path), str(batch_path), poll_interval=0)
+
+    # every request of the test set went into one batch
+    requests = [json.loads(line) for line in open(batch_path, encoding="utf-8")]
+    assert len(requests) == len(WEEKS) * len(CRYPTOS)
+    assert len(server.batches) == 1
+    assert not (tmp_path / "batch" / "cs.batch_id").exists()
+
+    # the failed request is left out of the record, the others are applied
+    with open(record_path, encoding="utf-8") as f:
+        record = json.load(f)
+    assert set(record["202410"]) == set(CRYPTOS)
+    assert set(record["202411"]) == {"bitcoin", "ethereum"}
+    assert record["202410"]["bitcoin"]["messages"][-2]["content"].startswith(
+        "Price trend: Rise"
+    )
+    assert [u["strength"] for u in env.portfolio.updates] == [
+        "Rise",
+        "Fall",
+        "Fall",
+        "Rise",
+        "Fall",
+    ]
+    assert env.portfolio.priced == len(WEEKS)
+
+    # replaying the record updates the portfolio as the batch run did
+    replay = make_env()
+    replay.load_record("cs", str(record_path))
+    for yw, info in record.items():
+        for crypto in info:
+            replay._process_replay("cs", yw, crypto, f"ret {crypto} {yw}")
+    assert [
+        (u["strength"], u["true_label"], u["prob"]) for u in replay.portfolio.updates
+    ] == [(u["strength"], u["true_label"], u["prob"]) for u in env.portfolio.updates]
+
+    # a rerun submits only the step that failed
+    server.respond = responder(set())
+    rerun = make_env()
+    rerun.run_batch("cs", str(record_path), str(batch_path), poll_interval=0)
+    assert len(server.batches) == 2
+    requests = [json.loads(line) for line in open(batch_path, encoding="utf-8")]
+    assert [request["custom_id"] for request in requests] == ["cs-202411-solana"]
+    with open(record_path, encoding="utf-8") as f:
+        assert set(json.load(f)["202411"]) == set(CRYPTOS)
+
+
+def test_run_batch_resumes_polling(server, make_env, monkeypatch, tmp_path):
+    record_path = tmp_path / "record_cs.json"
+    batch_path = tmp_path / "cs.jsonl"
+
+    def interrupt(seconds):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(environ.agent.time, "sleep", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        make_env().run_batch("cs", str(record_path), str(batch_path))
+    assert (tmp_path / "cs.batch_id").read_text() == "batch-0"
+
+    monkeypatch.setattr(environ.agent.time, "sleep", lambda seconds: None)
+    make_env().run_batch("cs", str(record_path), str(batch_path), poll_interval=0)
+
+    # the rerun polled the submitted batch rather than submitting it again
+    assert len(server.batches) == 1
+    assert server.batches["batch-0"]["status"] == "completed"
+    assert not (tmp_path / "cs.batch_id").exists()
+    with open(record_path, encoding="utf-8") as f:
+        assert sum(len(info) for info in json.load(f).values()) == 5
+
+
+def test_run_batch_when_every_step_is_done(server, make_env, tmp_path):
+    record_path = tmp_path / "record_cs.json"
+    batch_path = tmp_path / "cs.jsonl"
+
+    server.respond = responder(set())
+    make_env().run_batch("cs", str(record_path), str(batch_path), poll_interval=0)
+    record = record_path.read_text(encoding="utf-8")
+
+    # a rerun with nothing pending submits no empty batch
+    make_env().run_batch("cs", str(record_path), str(batch_path), poll_interval=0)
+    assert len(server.batches) == 1
+    assert not (tmp_path / "cs.batch_id").exists()
+    with open(record_path, encoding="utf-8") as f:
+        assert json.load(f) == json.loads(record)
+
+
+def test_batch_results_when_every_request_fails(server):
+    def fail(body):
+        raise RuntimeError("request failed")
+
+    server.respond = fail
+    agent = FTAgent(model="stand-in")
+    batch_id = (
+        server.client()
+        .batches.create(
+            input_file_id=server._add_file(
+                "batch",
+                json.dumps(
+                    agent.batch_request(
+                        "cs-202410-bitcoin",
+                        FakeDataHandler().cs_test_data["202410"]["bitcoin"],
+                        log_probs=True,
+                        top_logprobs=10,
+                    )
+                ).encode("utf-8"),
+            ),
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        .id
+    )
+
+    assert agent.batch_results(batch_id, poll_interval=0) == {}
+    assert server.batches[batch_id]["output_file_id"] is None
+    assert server.batches[batch_id]["error_file_id"] is not None
@@ -0,0 +1,67 @@
+"""
+Tests of resuming a fine-tuning set left behind by an interrupted run
+"""
+
+import shutil
+
+import pytest
+
+from environ.jsonl import JsonlWriter, read_jsonl
+from environ.prompt_generator import PromptGenerator
+
+LINES = [{"messages": [{"role": "user", "content": f"prompt {i}"}]} for i in range(50)]
+
+
+def interrupted(path: str, written: int, cut: int) -> None:
+    """
+    Leave the file as a run killed after a number of lines would, its last
+    write cut short by a given number of bytes
+    """
+    with JsonlWriter(path, append=True) as writer:
+        for line in LINES[:written]:
+            writer.write(line)
+            writer.flush()
+        # copy what reached the disk before the file is closed
+        shutil.copy(path, f"{path}.killed")
+
+    with open(f"{path}.killed", "rb") as f:
+        content = f.read()
+    with open(path, "wb") as f:
+        f.write(content[: len(content) - cut])
+
+
+def generator() -> PromptGenerator:
+    """
+    Prompt generator answering each training prompt with the next line
+    """
+    generator = PromptGenerator.__new__(PromptGenerator)
+    generator.skipped = []
+
+    def get_cs_prompt(train_test: str, concurrency: int, skip: int, **kwargs):
+        generator.skipped.append(skip)
+        for i, line in enumerate(LINES[skip:], skip):
+            yield i, line
+
+    generator.get_cs_prompt = get_cs_prompt
+
+    return generator
+
+
+@pytest.mark.parametrize("suffix", [".jsonl", ".jsonl.zst"])
+def test_write_train_set_resumes(suffix, tmp_path):
+    if suffix.endswith(".zst"):
+        pytest.importorskip("zstandard")
+    path = str(tmp_path / f"train{suffix}")
+    interrupted(path, written=20, cut=5)
+
+    pg = generator()
+    pg.write_train_set(path)
+
+    # the run picks up after the lines that survived and none is repeated
+    assert 0 < pg.skipped[0] < 20
+    assert list(read_jsonl(path)) == LINES
+
+    # a finished set is resumed after its last line
+    pg.write_train_set(path)
+    assert pg.skipped[1] == len(LINES)
+    assert list(read_jsonl(path)) == LINES